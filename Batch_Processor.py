@@ -0,0 +1,107 @@
+import argparse
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import cv2
+
+from Image_Pipeline import EXPORT_PRESETS, load_rgb, render_recipe, save_rgb
+
+# Applies an editor recipe (saved with "Save Recipe" in Image_Editor_App.py)
+# to every image in a directory without a Tk root. Output matches what the
+# editor writes through "Save Cropped Image" for the same settings.
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+_recipe = None
+_budget = None
+_options = None
+
+
+def init_worker(recipe, budget=None, options=None):
+    global _recipe, _budget, _options
+    _recipe = recipe
+    _budget = budget
+    _options = options
+    # One OpenCV thread per process, the pool already uses every core
+    cv2.setNumThreads(1)
+
+
+def process_file(job):
+    src, dst = job
+    try:
+        result = render_recipe(load_rgb(src), _recipe, _budget)
+        if result is None:
+            return src, "crop area is empty for this image"
+        save_rgb(dst, result, _options)
+    except Exception as e:
+        return src, str(e)
+    return src, None
+
+
+def find_images(input_dir):
+    return sorted(
+        os.path.join(input_dir, name) for name in os.listdir(input_dir)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def run_batch(input_dir, output_dir, recipe, workers=None, ext=".png", quiet=False, budget=None,
+              options=None):
+    files = find_images(input_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = [
+        (src, os.path.join(output_dir, os.path.splitext(os.path.basename(src))[0] + ext))
+        for src in files
+    ]
+
+    failures = []
+    start = time.perf_counter()
+    with Pool(workers, initializer=init_worker, initargs=(recipe, budget, options)) as pool:
+        for done, (src, error) in enumerate(pool.imap_unordered(process_file, jobs), 1):
+            if error is not None:
+                failures.append((src, error))
+            if not quiet:
+                print(f"\r{done}/{len(jobs)} images", end="", file=sys.stderr)
+    elapsed = time.perf_counter() - start
+    if not quiet and jobs:
+        print(file=sys.stderr)
+
+    rate = len(jobs) / elapsed if elapsed > 0 else 0.0
+    return len(jobs), failures, elapsed, rate
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply an Image Editor recipe to a directory of images.")
+    parser.add_argument("input_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("--recipe", required=True,
+                        help="JSON recipe saved from the editor. Crop coordinates are in pixels and are clipped to each image.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU)")
+    parser.add_argument("--ext", default=".png", choices=[".png", ".jpg", ".jpeg", ".bmp", ".webp"],
+                        help="Output file extension (default: .png, like the editor)")
+    parser.add_argument("--preset", default="default", choices=sorted(EXPORT_PRESETS),
+                        help="Encoder settings: default, fastest (write speed) or smallest (file size)")
+    parser.add_argument("--memory-budget", type=int, default=None, metavar="MB",
+                        help="Process each image in tiles using about this much working memory per worker "
+                             "(more when strong filters on wide images need it)")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    with open(args.recipe) as f:
+        recipe = json.load(f)
+
+    budget = args.memory_budget * 1024 * 1024 if args.memory_budget else None
+    count, failures, elapsed, rate = run_batch(args.input_dir, args.output_dir, recipe,
+                                               args.workers, args.ext, args.quiet, budget,
+                                               EXPORT_PRESETS[args.preset])
+    for src, error in failures:
+        print(f"Failed: {src}: {error}", file=sys.stderr)
+    print(f"Processed {count - len(failures)}/{count} images in {elapsed:.2f}s ({rate:.2f} images/sec)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
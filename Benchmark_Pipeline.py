@@ -0,0 +1,198 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import Image_Pipeline as pipeline
+
+# Times each stage of the editor's filter pipeline on synthetic images and
+# writes latency percentiles and peak memory as JSON. A previous run can be
+# passed as a baseline; stages that got slower than the threshold are
+# reported as regressions and the exit status is 1.
+#
+# Peak memory is what tracemalloc sees, i.e. every NumPy array a stage
+# allocates (OpenCV returns its results as NumPy arrays), not OpenCV's
+# internal scratch buffers.
+
+DEFAULT_SIZES = (1, 4, 16, 50, 100)
+SEED = 137
+
+
+def params(**kw):
+    return dict(pipeline.DEFAULT_PARAMS, **kw)
+
+
+def crop_resize(img):
+    h, w = img.shape[:2]
+    return pipeline.resize_crop(img[h // 4:3 * h // 4, w // 4:3 * w // 4], 50)
+
+
+# (name, function taking the synthetic RGB image)
+CASES = [
+    ("rotation", lambda img: pipeline.rotate(img, params(rotation=17))),
+    ("hsv", lambda img: pipeline.point_ops(img, params(hue=20, sat=15, val=-10))),
+    ("brightness_contrast", lambda img: pipeline.point_ops(img, params(brightness=20, contrast=1.3))),
+    ("sepia", lambda img: pipeline.point_ops(img, params(sepia=True))),
+    ("sharpen", lambda img: pipeline.sharpen(img, params(sharpen=True))),
+    ("blur_3", lambda img: pipeline.blur(img, params(blur=3))),
+    ("blur_9", lambda img: pipeline.blur(img, params(blur=9))),
+    ("blur_21", lambda img: pipeline.blur(img, params(blur=21))),
+    ("sketch", lambda img: pipeline.sketch(img, params(sketch=True))),
+    ("cartoon", lambda img: pipeline.cartoon(img, params(cartoon=True))),
+    ("sketch_fast", lambda img: pipeline.sketch(img, params(sketch=True, quality="fast"))),
+    ("cartoon_fast", lambda img: pipeline.cartoon(img, params(cartoon=True, quality="fast"))),
+    ("crop_resize", crop_resize),
+    ("png_write", lambda img: cv2.imencode(".png", img)),
+    ("jpeg_write", lambda img: cv2.imencode(".jpg", img)),
+    ("full_pipeline", lambda img: pipeline.apply_pipeline(
+        img, params(rotation=5, hue=10, brightness=10, contrast=1.2, sharpen=True, blur=3))),
+    ("gray_pipeline", lambda img: pipeline.apply_pipeline(
+        img, params(grayscale=True, invert=True, sharpen=True, blur=9, sketch=True))),
+]
+
+
+def synthetic_image(megapixels, seed=SEED):
+    # Smooth gradients plus noise, so encoders and edge-aware filters see
+    # something closer to a photo than pure noise
+    width = int(round((megapixels * 1e6 * 3 / 2) ** 0.5))
+    height = int(round(megapixels * 1e6 / width))
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (max(2, height // 64), max(2, width // 64), 3), dtype=np.uint8)
+    img = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    noise = rng.integers(0, 24, (height, width, 3), dtype=np.uint8)
+    cv2.add(img, noise, dst=img)
+    return img
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q))
+
+
+def run_case(func, img, repeat):
+    func(img)  # Warm up caches, lookup tables and OpenCV dispatch
+
+    times = []
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        func(img)
+        times.append((time.perf_counter() - start) * 1000)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+    return {
+        "repeat": repeat,
+        "min_ms": min(times),
+        "mean_ms": float(np.mean(times)),
+        "p50_ms": percentile(times, 50),
+        "p90_ms": percentile(times, 90),
+        "p99_ms": percentile(times, 99),
+        "peak_bytes": peak,
+    }
+
+
+def run_benchmarks(sizes, stages, repeat, quiet=False):
+    results = []
+    tracemalloc.start()
+    for megapixels in sizes:
+        img = synthetic_image(megapixels)
+        for name, func in CASES:
+            if stages and name not in stages:
+                continue
+            record = {"stage": name, "megapixels": megapixels,
+                      "width": img.shape[1], "height": img.shape[0]}
+            record.update(run_case(func, img, repeat))
+            results.append(record)
+            if not quiet:
+                print(f"{megapixels:>6} MP  {name:<20} p50 {record['p50_ms']:10.2f} ms  "
+                      f"p90 {record['p90_ms']:10.2f} ms  peak {record['peak_bytes'] / 2**20:9.1f} MB",
+                      file=sys.stderr)
+        del img
+    tracemalloc.stop()
+    return results
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "opencv_threads": cv2.getNumThreads(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def compare(results, baseline, threshold):
+    # A stage regresses when its median got slower by more than threshold
+    base = {(r["stage"], r["megapixels"]): r for r in baseline["results"]}
+    regressions = []
+    for record in results:
+        old = base.get((record["stage"], record["megapixels"]))
+        if old is None:
+            continue
+        change = record["p50_ms"] / old["p50_ms"] - 1 if old["p50_ms"] > 0 else 0.0
+        record["baseline_p50_ms"] = old["p50_ms"]
+        record["change"] = change
+        if change > threshold:
+            regressions.append(record)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the image filter pipeline.")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES),
+                        help="Comma separated image sizes in megapixels (default: %(default)s)")
+    parser.add_argument("--stages", default="",
+                        help="Comma separated stages to run (default: all of " +
+                             ", ".join(name for name, func in CASES) + ")")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per stage and size")
+    parser.add_argument("--threads", type=int, default=None, help="OpenCV worker threads (default: OpenCV's choice)")
+    parser.add_argument("--output", help="Write results as JSON to this file instead of stdout")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Allowed slowdown of the median before a stage is a regression (default: 0.10)")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.threads is not None:
+        cv2.setNumThreads(args.threads)
+    sizes = [float(s) if "." in s else int(s) for s in args.sizes.split(",") if s]
+    stages = set(s for s in args.stages.split(",") if s)
+    unknown = stages - set(name for name, func in CASES)
+    if unknown:
+        parser.error("unknown stages: " + ", ".join(sorted(unknown)))
+
+    report = {"environment": environment(), "results": run_benchmarks(sizes, stages, args.repeat, args.quiet)}
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report["results"], baseline, args.threshold)
+        report["baseline"] = args.baseline
+        report["regressions"] = [(r["stage"], r["megapixels"]) for r in regressions]
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    for r in regressions:
+        print(f"REGRESSION {r['stage']} at {r['megapixels']} MP: p50 {r['baseline_p50_ms']:.2f} ms -> "
+              f"{r['p50_ms']:.2f} ms ({r['change']:+.0%})", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
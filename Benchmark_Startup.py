@@ -0,0 +1,139 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+from Benchmark_Pipeline import environment, percentile
+
+# Times the editor's startup: from starting the process to the first frame
+# in which it can be used (window up, pipeline imported, Load enabled). Each
+# run starts "Image_Editor_App.py --startup-report", which prints its own
+# phase timings and quits once it is interactive. Like Benchmark_Pipeline,
+# a previous run can be passed as a baseline and a slower median than the
+# threshold allows is a regression (exit status 1). Needs a display.
+
+EDITOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Image_Editor_App.py")
+
+# Reported metrics: measured here from process start, then the editor's own
+# phases, measured from when its module started running
+METRICS = ("process_to_interactive", "window_shown", "modules_imported", "interactive")
+
+
+def run_once(timeout):
+    # {metric: ms} for one editor start
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, EDITOR, "--startup-report"],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    # The report line is read on a thread so an editor that stalls before it
+    # is interactive (a modal error, say) fails the run after timeout
+    report = []
+
+    def read_report():
+        report.append((proc.stdout.readline(), time.perf_counter()))
+
+    reader = threading.Thread(target=read_report, daemon=True)
+    reader.start()
+    reader.join(timeout)
+    try:
+        if reader.is_alive():
+            raise subprocess.TimeoutExpired(EDITOR, timeout)
+        proc.wait(max(0.0, timeout - (time.perf_counter() - start)))
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+        raise RuntimeError(f"editor did not finish within {timeout}s")
+    line, reported = report[0]
+    elapsed = (reported - start) * 1000
+    if not line:
+        raise RuntimeError("editor exited without a startup report:\n" + proc.stderr.read())
+    record = json.loads(line)
+    record["process_to_interactive"] = elapsed
+    return record
+
+
+def run_benchmark(repeat, warmup=1, timeout=60, quiet=False):
+    # The warm-up runs fill the OS file cache and are not reported
+    for _ in range(warmup):
+        run_once(timeout)
+    runs = [run_once(timeout) for _ in range(repeat)]
+
+    results = []
+    for metric in METRICS:
+        times = [run[metric] for run in runs]
+        record = {
+            "metric": metric,
+            "repeat": repeat,
+            "min_ms": min(times),
+            "mean_ms": float(np.mean(times)),
+            "p50_ms": percentile(times, 50),
+            "p90_ms": percentile(times, 90),
+        }
+        results.append(record)
+        if not quiet:
+            print(f"{metric:<24} p50 {record['p50_ms']:8.1f} ms  p90 {record['p90_ms']:8.1f} ms", file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, threshold):
+    # A metric regresses when its median got slower by more than threshold
+    base = {r["metric"]: r for r in baseline["results"]}
+    regressions = []
+    for record in results:
+        old = base.get(record["metric"])
+        if old is None:
+            continue
+        change = record["p50_ms"] / old["p50_ms"] - 1 if old["p50_ms"] > 0 else 0.0
+        record["baseline_p50_ms"] = old["p50_ms"]
+        record["change"] = change
+        if change > threshold:
+            regressions.append(record)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the image editor's startup time.")
+    parser.add_argument("--repeat", type=int, default=10, help="Timed editor starts (default: %(default)s)")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed starts first (default: %(default)s)")
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds to wait for one start")
+    parser.add_argument("--output", help="Write results as JSON to this file instead of stdout")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Allowed slowdown of the median before a metric is a regression (default: 0.10)")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    try:
+        results = run_benchmark(args.repeat, args.warmup, args.timeout, args.quiet)
+    except RuntimeError as e:
+        print(f"Startup benchmark failed: {e}", file=sys.stderr)
+        return 2
+    report = {"environment": environment(), "results": results}
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report["results"], baseline, args.threshold)
+        report["baseline"] = args.baseline
+        report["regressions"] = [r["metric"] for r in regressions]
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    for r in regressions:
+        print(f"REGRESSION {r['metric']}: p50 {r['baseline_p50_ms']:.1f} ms -> "
+              f"{r['p50_ms']:.1f} ms ({r['change']:+.0%})", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
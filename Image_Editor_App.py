@@ -1,11 +1,128 @@
+import json
+import os
+import sys
+import threading
+import time
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from PIL import Image, ImageTk
-import cv2
-import numpy as np
+
+STARTED = time.perf_counter()  # Startup timings are measured from here
+
+
+def import_modules():
+    # OpenCV, NumPy and Pillow (all imported by the pipeline) are most of
+    # the startup time, so they are imported on a background thread once
+    # the window is up. The editor uses them only after modules_ready.
+    global cv2, np, Image, ImageTk, pipeline
+    import cv2
+    import numpy as np
+    from PIL import Image, ImageTk
+    import Image_Pipeline as pipeline
+
+
+# Working memory allowed for a full resolution render before it switches to
+# tiled processing (large panoramas and scans)
+TILE_MEMORY_BUDGET = 512 * 1024 * 1024
+
+# Memory kept for recently rendered results so undo/redo can skip rendering
+RENDER_CACHE_BUDGET = 256 * 1024 * 1024
+
+# Memory for everything the editor holds: images, display buffers and
+# caches. Caches are evicted when the total goes over; the status bar shows
+# where it stands.
+MEMORY_BUDGET = 1024 * 1024 * 1024
+
+# Crops up to this many pixels get an exact full resolution preview rendered
+# over just the crop region; larger crops keep the proxy preview
+CROP_PREVIEW_MAX_PIXELS = 4 * 1024 * 1024
+
+# Milliseconds between live crop previews while the crop rectangle is dragged
+CROP_DRAG_INTERVAL = 33
+
+# Progressive renders first show the proxy shrunk by this factor per side.
+# The coarse pass is skipped while preview renders take less than
+# PROGRESSIVE_MIN_SECONDS, where it would only add flicker.
+PROGRESSIVE_FACTOR = 4
+PROGRESSIVE_MIN_SECONDS = 0.05
+
+# Zoom of orig_canvas: each wheel step, and the deepest zoom in display
+# pixels per image pixel
+ZOOM_STEP = 1.25
+MAX_VIEW_SCALE = 8.0
+
+# Export presets as named in the export options dialog
+EXPORT_PRESET_LABELS = {"Default": "default", "Fastest Write": "fastest", "Smallest File": "smallest"}
+
+class RenderScheduler:
+    # Runs render jobs on a worker thread. Only the newest submitted job is
+    # kept: older jobs are dropped before they start or cancelled between
+    # stages, and only the newest result is handed back on the Tk thread.
+    def __init__(self, root, interval=15):
+        self.root = root
+        self.interval = interval
+        self.generation = 0
+        self.pending = None
+        self.result = None
+        self.cond = threading.Condition()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+        self.root.after(self.interval, self.poll)
+
+    def submit(self, job, callback):
+        # job(cancelled) runs on the worker; callback(result) runs on the Tk thread
+        self.submit_passes([(job, callback)])
+
+    def submit_passes(self, passes):
+        # Runs (job, callback) pairs in order and hands back each result, so a
+        # coarse render can be shown while sharper ones follow. A newer
+        # submit abandons the remaining passes.
+        with self.cond:
+            self.generation += 1
+            self.pending = (self.generation, passes)
+            self.cond.notify()
+
+    def cancel(self):
+        with self.cond:
+            self.generation += 1
+            self.pending = None
+
+    def is_stale(self, generation):
+        return generation != self.generation
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.pending is None:
+                    self.cond.wait()
+                generation, passes = self.pending
+                self.pending = None
+            for job, callback in passes:
+                try:
+                    result = job(lambda: self.is_stale(generation))
+                except Exception as e:
+                    result, callback = e, None
+                if result is None or self.is_stale(generation):
+                    break
+                with self.cond:
+                    self.result = (generation, result, callback)
+                if callback is None:
+                    break
+
+    def poll(self):
+        with self.cond:
+            item, self.result = self.result, None
+        if item is not None and not self.is_stale(item[0]):
+            generation, result, callback = item
+            if callback is None:
+                messagebox.showerror("Render Failed", str(result))
+            else:
+                callback(result)
+        self.root.after(self.interval, self.poll)
 
 class CropResizeApp:
-    def __init__(self, root):
+    def __init__(self, root, on_ready=None):
+        # The window is drawn before the heavy modules are imported;
+        # on_ready(app) is called once the editor can be used
         self.root = root
         self.root.title("Advanced Image Editor")
         self.root.geometry("1150x720")
@@ -17,9 +134,39 @@ class CropResizeApp:
         self.cv_image = None
         self.processed_image = None
         self.original_image = None  # To reset
-
+        self.image_size = (0, 0)  # Full resolution (width, height), known before the full decode
+
+        # Full resolution JPEG decodes finish on a background thread
+        self.full_loader = None
+        self.full_decode = None  # Filled by full_loader with the image or the error
+
+        # Preview renders run on a proxy scaled down to the canvas size
+        self.proxy_image = None
+        self.proxy_scale = 1.0
+        self.coarse_image = None  # First pass of progressive renders
+        self.coarse_scale = 1.0
+        self.last_render_seconds = 0.0
+        self.processed_scale = 1.0  # processed_image size relative to cv_image
+
+        # Filter graphs, render cache and memory manager, created by
+        # modules_ready once the pipeline is imported
+        self.preview_graph = None
+        self.coarse_graph = None
+        self.full_graph = None
+        self.render_cache = None
+        self.memory = None
+        self.startup_times = {}
+        self.on_ready = on_ready
+
+        # Display buffers, PhotoImages and canvas items are kept between
+        # updates and refilled in place while their size stays the same
         self.photo_original = None
         self.photo_cropped = None
+        self.orig_item = None
+        self.crop_item = None
+        self.display_buffer = None
+        self.crop_buffer = None
+        self.interacting = False  # Cheap resampling while a slider or crop drag is held
 
         self.crop_coords_from_mouse = False
 
@@ -29,13 +176,89 @@ class CropResizeApp:
         self.display_img_width = 0
         self.display_img_height = 0
 
+        # orig_canvas view: zoom relative to fit, and the full resolution
+        # image coordinates of the canvas origin
+        self.pyramid = None
+        self.zoom = 1.0
+        self.view_x = 0.0
+        self.view_y = 0.0
+        self.view_scale = 1.0  # Display pixels per image pixel, set by show_original_image
+        self.pan_start = None
+        self.crop_display_bytes = 0
+
         self.aspect_ratio_locked = tk.BooleanVar(value=True)
 
+        # Slider renders run off the Tk thread, newest request wins
+        self.scheduler = RenderScheduler(self.root)
+        self.crop_scheduler = RenderScheduler(self.root)
+        self.crop_region = None  # (key, full resolution render of the crop region)
+        # Zoomed past the proxy, the visible area is rendered from cv_image
+        self.view_scheduler = RenderScheduler(self.root)
+        self.view_region = None  # (key, box, full resolution render of box)
+        self.view_pending = None  # (key, box) being rendered
+
         self.create_widgets()
-        self.bind_shortcuts()
 
         self.root.update()
         self.root.focus_force()
+        self.startup_times["window_shown"] = time.perf_counter() - STARTED
+
+        self.status_var.set("Loading image libraries...")
+        self.module_error = None
+        self.module_loader = threading.Thread(target=self.load_modules, daemon=True)
+        self.module_loader.start()
+        self.root.after(10, self.check_modules)
+
+    def load_modules(self):
+        # Runs on the loader thread. An exception there would be lost, so it
+        # is kept for check_modules to report on the Tk thread.
+        try:
+            import_modules()
+        except Exception as e:
+            self.module_error = e
+
+    def check_modules(self):
+        if self.module_loader.is_alive():
+            self.root.after(10, self.check_modules)
+            return
+        if self.module_error is not None:
+            messagebox.showerror("Startup Failed", f"Could not load the image libraries: {self.module_error}")
+            self.root.destroy()
+            return
+        self.modules_ready()
+
+    def modules_ready(self):
+        self.startup_times["modules_imported"] = time.perf_counter() - STARTED
+
+        # One memoized filter graph per source resolution
+        self.preview_graph = pipeline.FilterGraph()
+        self.coarse_graph = pipeline.FilterGraph()
+        self.full_graph = pipeline.FilterGraph(tile_budget=TILE_MEMORY_BUDGET)
+
+        # Rendered results by (scale, filter settings) for the loaded image
+        self.render_cache = pipeline.ImageCache(RENDER_CACHE_BUDGET)
+
+        # Caches are evicted in this order, cheapest to rebuild first
+        self.memory = pipeline.MemoryManager(MEMORY_BUDGET)
+        self.memory.add_images("images", lambda: [
+            self.cv_image, self.original_image, self.proxy_image, self.coarse_image, self.processed_image,
+            self.display_buffer, self.crop_buffer, self.crop_region[1] if self.crop_region else None,
+            self.view_region[2] if self.view_region else None])
+        self.memory.add_cache("scratch", pipeline.SCRATCH)
+        self.memory.add_cache("pyramid", lambda: self.pyramid)
+        self.memory.add_cache("render cache", self.render_cache)
+        self.memory.add_cache("stages", self.coarse_graph)
+        self.memory.add_cache("stages", self.preview_graph)
+        self.memory.add_cache("stages", self.full_graph)
+
+        self.export_options = dict(pipeline.EXPORT_PRESETS["default"])
+        self.bind_shortcuts()
+        self.load_btn.config(state=tk.NORMAL)
+        self.update_memory_status()
+        self.root.update_idletasks()
+        self.startup_times["interactive"] = time.perf_counter() - STARTED
+        if self.on_ready is not None:
+            self.on_ready(self)
 
     def create_widgets(self):
         # Left control frame
@@ -48,11 +271,16 @@ class CropResizeApp:
         self.root.grid_columnconfigure(1, weight=1)
         self.root.grid_rowconfigure(0, weight=1)
 
+        # Status bar with the memory in use
+        self.status_var = tk.StringVar(value="")
+        ttk.Label(self.root, textvariable=self.status_var, anchor="w", relief=tk.SUNKEN,
+                  padding=(6, 2)).grid(row=1, column=0, columnspan=2, sticky="ew")
+
         # Actions
         action_frame = ttk.LabelFrame(self.control_frame, text="Actions", padding=8)
         action_frame.grid(row=0, column=0, sticky="ew", pady=(0,12))
 
-        self.load_btn = ttk.Button(action_frame, text="Load Image", command=self.load_image)
+        self.load_btn = ttk.Button(action_frame, text="Load Image", command=self.load_image, state=tk.DISABLED)
         self.load_btn.grid(row=0, column=0, pady=4, sticky="ew")
 
         self.save_btn = ttk.Button(action_frame, text="Save Cropped Image", command=self.save_cropped_image, state=tk.DISABLED)
@@ -67,6 +295,36 @@ class CropResizeApp:
         self.help_btn = ttk.Button(action_frame, text="Help / Shortcuts", command=self.show_help)
         self.help_btn.grid(row=4, column=0, pady=4, sticky="ew")
 
+        self.preview_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(action_frame, text="Fast Preview", variable=self.preview_var, command=self.apply_filters).grid(row=5, column=0, sticky="w", pady=2)
+
+        self.full_res_btn = ttk.Button(action_frame, text="Render Full Resolution", command=self.render_full_resolution, state=tk.DISABLED)
+        self.full_res_btn.grid(row=6, column=0, pady=4, sticky="ew")
+
+        self.recipe_btn = ttk.Button(action_frame, text="Save Recipe", command=self.save_recipe, state=tk.DISABLED)
+        self.recipe_btn.grid(row=7, column=0, pady=4, sticky="ew")
+
+        # Per-stage render timings, drawn over the image and optionally logged
+        self.profile_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(action_frame, text="Profiling Overlay", variable=self.profile_var,
+                        command=lambda: self.draw_profile_overlay(self.last_timings)).grid(row=8, column=0, sticky="w", pady=2)
+
+        self.profile_log = None
+        self.last_timings = []
+        self.profile_log_btn = ttk.Button(action_frame, text="Start Profile Log", command=self.toggle_profile_log)
+        self.profile_log_btn.grid(row=9, column=0, pady=4, sticky="ew")
+
+        # Exports run on a background thread; shown only while one is running
+        self.export_thread = None
+        self.export_preset = "Default"
+        self.export_options = None  # Set by modules_ready
+        self.export_bar = ttk.Progressbar(action_frame, mode="determinate", maximum=100)
+        self.export_bar.grid(row=10, column=0, pady=(4, 0), sticky="ew")
+        self.export_label = ttk.Label(action_frame, text="")
+        self.export_label.grid(row=11, column=0, sticky="w")
+        self.export_bar.grid_remove()
+        self.export_label.grid_remove()
+
         # Filters frame
         filter_frame = ttk.LabelFrame(self.control_frame, text="Basic Filters", padding=8)
         filter_frame.grid(row=1, column=0, sticky="ew", pady=(0,12))
@@ -93,6 +351,10 @@ class CropResizeApp:
         self.sharpen_var = tk.BooleanVar(value=False)
         ttk.Checkbutton(adv_filter_frame, text="Sharpen", variable=self.sharpen_var, command=self.apply_filters).grid(row=2, column=0, sticky="w", pady=2)
 
+        # Approximate sketch/cartoon in previews; exports always render exactly
+        self.fast_effects_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(adv_filter_frame, text="Fast Effects in Preview", variable=self.fast_effects_var, command=self.apply_filters).grid(row=3, column=0, sticky="w", pady=2)
+
         # Color adjustments frame
         color_frame = ttk.LabelFrame(self.control_frame, text="Color Adjustments (HSV)", padding=8)
         color_frame.grid(row=3, column=0, sticky="ew", pady=(0,12))
@@ -177,13 +439,27 @@ class CropResizeApp:
         self.crop_canvas.pack(fill=tk.BOTH, expand=True)
         self.crop_canvas.create_text(225, 275, text="Cropped + Resized", fill="black", font=("Arial", 14), tags="placeholder")
 
+        # Added to ttk's own Scale bindings, so dragging still works
+        self.root.bind_class("TScale", "<ButtonPress-1>", self.slider_pressed, add="+")
+        self.root.bind_class("TScale", "<ButtonRelease-1>", self.slider_released, add="+")
+
         self.orig_canvas.bind("<ButtonPress-1>", self.mouse_crop_start)
         self.orig_canvas.bind("<B1-Motion>", self.mouse_crop_drag)
         self.orig_canvas.bind("<ButtonRelease-1>", self.mouse_crop_end)
 
+        # Wheel zooms around the pointer (Button-4/5 on X11), right drag pans
+        self.orig_canvas.bind("<MouseWheel>", self.zoom_view)
+        self.orig_canvas.bind("<Button-4>", self.zoom_view)
+        self.orig_canvas.bind("<Button-5>", self.zoom_view)
+        self.orig_canvas.bind("<ButtonPress-3>", self.pan_start_event)
+        self.orig_canvas.bind("<B3-Motion>", self.pan_view)
+        self.orig_canvas.bind("<ButtonRelease-3>", self.pan_end_event)
+
         self.mouse_start_x = None
         self.mouse_start_y = None
+        self.mouse_end = None
         self.mouse_rect = None
+        self.crop_drag_job = None
 
         self.crop_x1 = 0
         self.crop_y1 = 0
@@ -195,8 +471,10 @@ class CropResizeApp:
         self.root.bind_all("<Control-s>", self.save_cropped_image_event)
         self.root.bind_all("<Control-z>", self.undo_crop_event)
         self.root.bind_all("<Control-y>", self.redo_crop_event)
+        self.root.bind_all("<Control-Key-0>", self.reset_view_event)
 
     def load_image_event(self, event): self.load_image()
+    def reset_view_event(self, event): self.reset_view()
     def save_cropped_image_event(self, event): self.save_cropped_image()
     def undo_crop_event(self, event): self.undo_crop()
     def redo_crop_event(self, event): self.redo_crop()
@@ -206,8 +484,40 @@ class CropResizeApp:
         if not file_path:
             return
 
-        self.cv_image = cv2.cvtColor(cv2.imread(file_path), cv2.COLOR_BGR2RGB)
-        self.original_image = self.cv_image.copy()
+        try:
+            w, h = pipeline.image_size(file_path)
+            reduced = pipeline.load_rgb_reduced(file_path, (w, h), self.canvas_size())
+            full = pipeline.load_rgb(file_path) if reduced is None else None
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Load Failed", str(e))
+            return
+
+        self.scheduler.cancel()
+        self.crop_scheduler.cancel()
+        self.crop_region = None
+        self.view_scheduler.cancel()
+        self.view_region = self.view_pending = None
+        self.render_cache.clear()
+        if (w, h) != self.image_size:
+            # Pooled scratch buffers are sized for the previous image
+            pipeline.SCRATCH.clear()
+        self.image_size = (w, h)
+        self.cv_image = None
+        self.original_image = None
+        self.processed_image = None
+        self.pyramid = None
+        self.zoom, self.view_x, self.view_y = 1.0, 0.0, 0.0
+        self.full_loader = None
+        if full is not None:
+            self.set_full_image(full)
+            self.build_proxy(full)
+        else:
+            # First paint comes from the reduced decode; the full image follows
+            self.build_proxy(reduced)
+            self.full_decode = []
+            self.full_loader = threading.Thread(target=self.decode_full_image, args=(file_path, self.full_decode), daemon=True)
+            self.full_loader.start()
+            self.root.after(50, self.check_full_image)
         self.undo_stack.clear()
         self.redo_stack.clear()
 
@@ -225,8 +535,6 @@ class CropResizeApp:
         self.blur_var.set(0)
         self.rotation_var.set(0)
 
-        h, w = self.cv_image.shape[:2]
-
         self.crop_x1 = 0
         self.crop_y1 = 0
         self.crop_x2 = w
@@ -238,14 +546,49 @@ class CropResizeApp:
 
         self.save_btn.config(state=tk.NORMAL)
         self.reset_btn.config(state=tk.NORMAL)
+        self.full_res_btn.config(state=tk.NORMAL)
+        self.recipe_btn.config(state=tk.NORMAL)
         self.crop_coords_from_mouse = False
 
         self.apply_filters()
 
+    def decode_full_image(self, file_path, result):
+        try:
+            result.append(pipeline.load_rgb(file_path))
+        except ValueError as e:
+            result.append(e)
+
+    def check_full_image(self):
+        if self.full_loader is None:
+            return
+        if not self.full_decode:
+            if self.full_loader.is_alive():
+                self.root.after(50, self.check_full_image)
+            return
+        result = self.full_decode.pop()
+        self.full_loader = None
+        if isinstance(result, Exception):
+            messagebox.showerror("Load Failed", str(result))
+            return
+        self.set_full_image(result)
+        self.update_memory_status()
+
+    def ensure_full_image(self):
+        # Blocks until the background decode finishes when the full image is needed now
+        if self.cv_image is None and self.full_loader is not None:
+            self.full_loader.join()
+            self.check_full_image()
+        return self.cv_image
+
+    def set_full_image(self, img):
+        # The reset copy shares cv_image, which is read only from here on
+        self.cv_image = pipeline.share(img)
+        self.original_image = img
+
     def reset_all(self):
-        if self.original_image is None:
+        if self.proxy_image is None:
             return
-        self.cv_image = self.original_image.copy()
+        self.cv_image = self.original_image
         self.grayscale_var.set(False)
         self.sepia_var.set(False)
         self.invert_var.set(False)
@@ -260,7 +603,7 @@ class CropResizeApp:
         self.blur_var.set(0)
         self.rotation_var.set(0)
 
-        h, w = self.cv_image.shape[:2]
+        w, h = self.image_size
         self.crop_x1, self.crop_y1, self.crop_x2, self.crop_y2 = 0, 0, w, h
         self.resize_var.set(100)
         self.width_var.set(w)
@@ -268,97 +611,354 @@ class CropResizeApp:
 
         self.apply_filters()
 
-    def show_original_image(self):
-        if self.processed_image is None:
-            return
-        img_pil = Image.fromarray(self.processed_image)
+    def canvas_size(self):
         width = self.orig_canvas.winfo_width()
         height = self.orig_canvas.winfo_height()
         if width < 10 or height < 10:
             width, height = 450, 550
-        img_pil.thumbnail((width, height), Image.Resampling.LANCZOS)
-        self.display_img_width, self.display_img_height = img_pil.size
-        self.photo_original = ImageTk.PhotoImage(img_pil)
-        self.orig_canvas.delete("all")
-        self.orig_canvas.config(width=self.display_img_width, height=self.display_img_height)
-        self.orig_canvas.create_image(0, 0, anchor=tk.NW, image=self.photo_original)
+        return width, height
+
+    def build_proxy(self, source):
+        # Downscale once so preview renders cost canvas-sized work. source may
+        # be the full image or a reduced decode of it.
+        w, h = self.image_size
+        width, height = self.canvas_size()
+        scale = min(1.0, width / w, height / h)
+        if scale < 1.0:
+            proxy_w = max(1, int(round(w * scale)))
+            proxy_h = max(1, int(round(h * scale)))
+            self.proxy_image = pipeline.share(cv2.resize(source, (proxy_w, proxy_h), interpolation=cv2.INTER_AREA))
+            self.proxy_scale = proxy_w / w
+        else:
+            self.proxy_image = pipeline.share(source)
+            self.proxy_scale = 1.0
+
+        proxy_h, proxy_w = self.proxy_image.shape[:2]
+        coarse_w, coarse_h = proxy_w // PROGRESSIVE_FACTOR, proxy_h // PROGRESSIVE_FACTOR
+        if coarse_w >= 16 and coarse_h >= 16:
+            self.coarse_image = pipeline.share(cv2.resize(self.proxy_image, (coarse_w, coarse_h), interpolation=cv2.INTER_AREA))
+            self.coarse_scale = coarse_w / w
+        else:
+            self.coarse_image = None
+
+    def view_transform(self):
+        # (display pixels per image pixel, image x and y at the canvas
+        # origin), with the origin clamped so the view stays on the image.
+        # Zoom 1 fits the whole image like the unzoomed canvas always did.
+        w, h = self.image_size
+        width, height = self.canvas_size()
+        scale = min(1.0, width / w, height / h) * self.zoom
+        x0 = min(max(0.0, self.view_x), max(0.0, w - width / scale))
+        y0 = min(max(0.0, self.view_y), max(0.0, h - height / scale))
+        return scale, x0, y0
 
-    def apply_filters(self, event=None, update=True):
-        if self.cv_image is None:
+    def show_original_image(self):
+        # Draws the visible part of processed_image from the nearest pyramid
+        # level, so a zoom or pan only costs a canvas-sized warp
+        if self.processed_image is None:
+            return
+        if self.pyramid is None or self.pyramid.base is not self.processed_image:
+            self.pyramid = pipeline.ImagePyramid(self.processed_image)
+        scale, x0, y0 = self.view_transform()
+        self.view_scale, self.view_x, self.view_y = scale, x0, y0
+
+        w, h = self.image_size
+        width, height = self.canvas_size()
+        size = (max(1, min(width, int(round((w - x0) * scale)))),
+                max(1, min(height, int(round((h - y0) * scale)))))
+        detail = self.view_detail(scale, x0, y0, size)
+        if detail is not None:
+            # Full resolution render whose top left is image pixel (ox, oy)
+            level, ox, oy = detail
+            lx = ly = 1.0
+        else:
+            level, rx, ry = self.pyramid.level_for(scale / self.processed_scale)
+            # Level pixels per image pixel
+            lx = rx * self.processed_image.shape[1] / w
+            ly = ry * self.processed_image.shape[0] / h
+            ox = oy = 0
+        # Level pixels per display pixel
+        ax, ay = lx / scale, ly / scale
+        if abs(ax - 1) * size[0] < 0.5 and abs(ay - 1) * size[1] < 0.5:
+            # Same resolution as the display to within half a pixel: copy
+            ax = ay = 1.0
+            bx, by = round(lx * x0 - ox), round(ly * y0 - oy)
+        else:
+            # Display pixel centres mapped to level pixel centres
+            bx = lx * x0 - ox + 0.5 * ax - 0.5
+            by = ly * y0 - oy + 0.5 * ay - 0.5
+        M = np.float32([[ax, 0, bx], [0, ay, by]])
+
+        if self.display_buffer is None or self.display_buffer.shape[:2] != (size[1], size[0]):
+            self.display_buffer = np.empty((size[1], size[0], 3), np.uint8)
+        interpolation = cv2.INTER_NEAREST if self.interacting else cv2.INTER_LINEAR
+        cv2.warpAffine(level, M, size, dst=self.display_buffer, flags=interpolation | cv2.WARP_INVERSE_MAP,
+                       borderMode=cv2.BORDER_REPLICATE)
+        self.display_img_width, self.display_img_height = size
+        self.photo_original, self.orig_item = self.blit(
+            self.orig_canvas, self.photo_original, self.orig_item, self.display_buffer)
+
+    def view_detail(self, scale, x0, y0, size):
+        # Zoomed past the proxy's resolution, upscaling it only enlarges its
+        # pixels. Returns (region, x, y) when a full resolution render of the
+        # visible area is at hand; otherwise starts one in the background
+        # and returns None so the proxy is shown meanwhile. Compared with the
+        # proxy rather than the pass on screen, so coarse passes and fit
+        # zoom never start a full resolution render.
+        w, h = self.image_size
+        if (self.zoom <= 1.0 or self.processed_scale >= 1.0 or self.proxy_scale >= 1.0
+                or self.cv_image is None or scale * w <= self.proxy_image.shape[1] + 0.5):
+            return None
+        x1, y1 = int(x0), int(y0)
+        x2 = min(w, int(x0 + size[0] / scale) + 2)
+        y2 = min(h, int(y0 + size[1] / scale) + 2)
+        params = self.filter_params()
+        key = tuple(sorted(params.items()))
+
+        def covers(entry):
+            (ex1, ey1, ex2, ey2) = entry[1]
+            return entry[0] == key and ex1 <= x1 and ey1 <= y1 and ex2 >= x2 and ey2 >= y2
+
+        if self.view_region is not None and covers(self.view_region):
+            return self.view_region[2], self.view_region[1][0], self.view_region[1][1]
+        if self.interacting or (self.view_pending is not None and covers(self.view_pending)):
+            return None
+        if (x2 - x1) * (y2 - y1) > CROP_PREVIEW_MAX_PIXELS:
+            return None
+        # A margin around the view lets small pans reuse the render
+        mx, my = (x2 - x1) // 4, (y2 - y1) // 4
+        box = (max(0, x1 - mx), max(0, y1 - my), min(w, x2 + mx), min(h, y2 + my))
+        source = self.cv_image
+        self.view_pending = (key, box)
+        self.view_scheduler.submit(
+            lambda cancelled: pipeline.render_region(source, params, box, cancelled=cancelled),
+            lambda region: self.view_region_done(key, box, region))
+        return None
+
+    def view_region_done(self, key, box, region):
+        self.view_region = (key, box, region)
+        self.view_pending = None
+        self.show_original_image()
+
+    def zoom_view(self, event):
+        if self.processed_image is None:
             return
+        # Keep the image point under the pointer where it is
+        scale, x0, y0 = self.view_transform()
+        px, py = x0 + event.x / scale, y0 + event.y / scale
+        zoom_in = event.num == 4 or getattr(event, "delta", 0) > 0
+        fit = scale / self.zoom
+        self.zoom = self.zoom * ZOOM_STEP if zoom_in else self.zoom / ZOOM_STEP
+        self.zoom = min(max(1.0, self.zoom), max(1.0, MAX_VIEW_SCALE / fit))
+        self.view_x = px - event.x / (fit * self.zoom)
+        self.view_y = py - event.y / (fit * self.zoom)
+        self.show_original_image()
+
+    def pan_start_event(self, event):
+        self.pan_start = (event.x, event.y, self.view_x, self.view_y)
+        self.interacting = True
+
+    def pan_view(self, event):
+        if self.processed_image is None or self.pan_start is None:
+            return
+        x, y, view_x, view_y = self.pan_start
+        self.view_x = view_x - (event.x - x) / self.view_scale
+        self.view_y = view_y - (event.y - y) / self.view_scale
+        self.show_original_image()
+
+    def pan_end_event(self, event):
+        self.pan_start = None
+        self.interacting = False
+        self.show_original_image()
+
+    def reset_view(self):
+        self.zoom, self.view_x, self.view_y = 1.0, 0.0, 0.0
+        self.show_original_image()
+
+    def resize_for_display(self, src, size, buffer):
+        # Resizes into buffer, reallocating only when the display size changes
+        w, h = size
+        if buffer is None or buffer.shape[:2] != (h, w):
+            buffer = np.empty((h, w, 3), np.uint8)
+        if src.shape[:2] == (h, w):
+            np.copyto(buffer, src)
+        else:
+            interpolation = cv2.INTER_NEAREST if self.interacting else cv2.INTER_AREA
+            cv2.resize(src, size, dst=buffer, interpolation=interpolation)
+        return buffer
+
+    def blit(self, canvas, photo, item, buffer):
+        # Pastes buffer into the existing PhotoImage when the size matches,
+        # otherwise swaps in a new one on the same canvas item
+        h, w = buffer.shape[:2]
+        img_pil = Image.fromarray(buffer)
+        if photo is not None and (photo.width(), photo.height()) == (w, h):
+            photo.paste(img_pil)
+            return photo, item
+        photo = ImageTk.PhotoImage(img_pil)
+        if item is None:
+            canvas.delete("placeholder")
+            item = canvas.create_image(0, 0, anchor=tk.NW, image=photo)
+        else:
+            canvas.itemconfig(item, image=photo)
+        canvas.config(width=w, height=h)
+        return photo, item
+
+    def slider_pressed(self, event=None):
+        self.interacting = True
+
+    def slider_released(self, event=None):
+        # Redraw the last render with the high quality resampler
+        self.interacting = False
+        if self.processed_image is not None:
+            self.show_original_image()
+            self.update_cropped_image()
 
-        img = self.cv_image.copy()
+    def apply_filters(self, event=None, update=True, full_res=False):
+        if self.proxy_image is None:
+            return
 
-        # Rotation
-        angle = self.rotation_var.get()
-        if angle != 0:
-            h, w = img.shape[:2]
-            M = cv2.getRotationMatrix2D((w/2, h/2), angle, 1)
-            img = cv2.warpAffine(img, M, (w, h))
-
-        # HSV adjustment
-        hsv = cv2.cvtColor(img, cv2.COLOR_RGB2HSV).astype(np.float32)
-        h, s, v = cv2.split(hsv)
-        h = (h + self.hue_var.get()) % 180
-        s = np.clip(s + self.sat_var.get() * 2.55, 0, 255)
-        v = np.clip(v + self.val_var.get() * 2.55, 0, 255)
-        hsv = cv2.merge([h, s, v]).astype(np.uint8)
-        img = cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB)
-
-        # Brightness and contrast
-        brightness = self.brightness_var.get()
-        contrast = self.contrast_var.get()
-        img = cv2.convertScaleAbs(img, alpha=contrast, beta=brightness)
-
-        # Filters
-        if self.grayscale_var.get():
-            gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-            img = cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB)
-
-        if self.sepia_var.get():
-            kernel = np.array([[0.393, 0.769, 0.189],
-                               [0.349, 0.686, 0.168],
-                               [0.272, 0.534, 0.131]])
-            img = cv2.transform(img, kernel)
-            img = np.clip(img, 0, 255).astype(np.uint8)
-
-        if self.invert_var.get():
-            img = 255 - img
-
-        if self.sharpen_var.get():
-            kernel = np.array([[0, -1, 0],
-                               [-1, 5, -1],
-                               [0, -1, 0]])
-            img = cv2.filter2D(img, -1, kernel)
-
-        if self.blur_var.get() > 0:
-            ksize = self.blur_var.get()
-            if ksize % 2 == 0:
-                ksize += 1
-            img = cv2.GaussianBlur(img, (ksize, ksize), 0)
-
-        if self.sketch_var.get():
-            gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-            inv = 255 - gray
-            blur = cv2.GaussianBlur(inv, (21,21), 0)
-            inv_blur = 255 - blur
-            sketch = cv2.divide(gray, inv_blur, scale=256.0)
-            img = cv2.cvtColor(sketch, cv2.COLOR_GRAY2RGB)
-
-        if self.cartoon_var.get():
-            # Simple cartoon effect
-            img_gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-            img_blur = cv2.medianBlur(img_gray, 7)
-            edges = cv2.adaptiveThreshold(img_blur, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
-                                          cv2.THRESH_BINARY, 9, 2)
-            color = cv2.bilateralFilter(img, 9, 300, 300)
-            cartoon = cv2.bitwise_and(color, color, mask=edges)
-            img = cartoon
+        # Tk variables are read here on the Tk thread; the worker only sees the snapshot
+        params = self.filter_params()
+        if full_res or not self.preview_var.get():
+            source, scale = self.ensure_full_image(), 1.0
+            if source is None:
+                return
+        else:
+            source, scale = self.proxy_image, self.proxy_scale
+            if self.fast_effects_var.get():
+                params["quality"] = "fast"
+
+        graph = self.graph_for(source)
+        if not update:
+            # Synchronous render without touching the canvases
+            self.scheduler.cancel()
+            self.processed_image = graph.render(source, params, scale)
+            self.processed_scale = scale
+            return
+
+        key = (scale, tuple(sorted(params.items())))
+        self.crop_scheduler.cancel()
+        cached = self.render_cache.get(key)
+        if cached is not None:
+            # Already rendered, e.g. when stepping through undo/redo
+            self.scheduler.cancel()
+            self.show_processed(cached, scale, [("render_cache", 0.0, 0)])
+            return
 
+        # Progressive passes: coarse proxy, then the proxy before a full
+        # resolution render, then the requested render
+        passes = []
+        if self.coarse_image is not None and (source is not self.proxy_image
+                                              or self.last_render_seconds >= PROGRESSIVE_MIN_SECONDS):
+            passes.append(self.render_pass(self.coarse_graph, self.coarse_image, self.coarse_scale,
+                                           dict(params, quality="fast")))
+        if source is not self.proxy_image:
+            proxy_params = dict(params, quality="fast") if self.fast_effects_var.get() else params
+            passes.append(self.render_pass(self.preview_graph, self.proxy_image, self.proxy_scale, proxy_params))
+        passes.append(self.render_pass(graph, source, scale, params, final=True))
+        self.scheduler.submit_passes(passes)
+
+    def render_pass(self, graph, source, scale, params, final=False):
+        key = (scale, tuple(sorted(params.items())))
+        timings = []
+        return (lambda cancelled: graph.render(source, params, scale, cancelled, timings),
+                lambda img: self.render_done(key, img, scale, timings, final))
+
+    def render_done(self, key, img, scale, timings=None, final=True):
+        # Only final passes are cached; the earlier ones use fast effects
+        if final:
+            self.render_cache.put(key, img)
+        if final and timings:
+            self.last_render_seconds = sum(t[1] for t in timings)
+        self.show_processed(img, scale, timings, final)
+
+    def show_processed(self, img, scale, timings=None, final=True):
+        # Only the final pass of a progressive render starts the exact crop preview
         self.processed_image = img
-        if update:
-            self.show_original_image()
-            self.update_cropped_image()
+        self.processed_scale = scale
+        timings = list(timings or [])
+        start = time.perf_counter()
+        self.show_original_image()
+        mid = time.perf_counter()
+        self.update_cropped_image(exact=final)
+        end = time.perf_counter()
+        timings.append(("show_original_image", mid - start, self.display_img_width * self.display_img_height * 3))
+        timings.append(("update_cropped_image", end - mid, self.crop_display_bytes))
+        self.report_profile(timings, scale)
+        self.update_memory_status()
+
+    def update_memory_status(self):
+        # Evicts caches if the editor is over budget, then shows what is held
+        usage = {}
+        for name, nbytes in self.memory.enforce():
+            usage[name] = usage.get(name, 0) + nbytes
+        total = sum(usage.values())
+        parts = ", ".join(f"{name} {nbytes / 2**20:.0f} MB" for name, nbytes in usage.items() if nbytes >= 2**19)
+        self.status_var.set(f"Memory {total / 2**20:.0f} MB of {self.memory.budget / 2**20:.0f} MB"
+                            + (f" ({parts})" if parts else ""))
+
+    def report_profile(self, timings, scale):
+        self.last_timings = timings
+        if self.profile_log is not None:
+            record = {
+                "time": time.time(),
+                "image_size": list(self.image_size),
+                "scale": scale,
+                "stages": [{"stage": name, "ms": round(seconds * 1000, 3), "bytes": nbytes}
+                           for name, seconds, nbytes in timings],
+                "total_ms": round(sum(seconds for name, seconds, nbytes in timings) * 1000, 3),
+            }
+            self.profile_log.write(json.dumps(record) + "\n")
+            self.profile_log.flush()
+        self.draw_profile_overlay(timings)
+
+    def draw_profile_overlay(self, timings):
+        self.orig_canvas.delete("profile")
+        if not self.profile_var.get() or not timings:
+            return
+        lines = [f"{name:<21}{seconds * 1000:8.1f} ms{nbytes / 2**20:8.1f} MB"
+                 for name, seconds, nbytes in timings]
+        lines.append(f"{'total':<21}{sum(t[1] for t in timings) * 1000:8.1f} ms")
+        self.orig_canvas.create_text(8, 8, anchor=tk.NW, text="\n".join(lines), fill="yellow",
+                                     font=("Courier", 9), tags="profile")
+
+    def toggle_profile_log(self):
+        # Streams one JSON line per render, for collecting profiles from real sessions
+        if self.profile_log is not None:
+            self.profile_log.close()
+            self.profile_log = None
+            self.profile_log_btn.config(text="Start Profile Log")
+            return
+        file_path = filedialog.asksaveasfilename(defaultextension=".jsonl",
+                                                 filetypes=[("JSON lines", "*.jsonl")])
+        if not file_path:
+            return
+        self.profile_log = open(file_path, "a")
+        self.profile_log_btn.config(text="Stop Profile Log")
+
+    def render_full_resolution(self):
+        self.apply_filters(full_res=True)
+
+    def filter_params(self):
+        return {
+            "rotation": self.rotation_var.get(),
+            "hue": self.hue_var.get(),
+            "sat": self.sat_var.get(),
+            "val": self.val_var.get(),
+            "brightness": self.brightness_var.get(),
+            "contrast": self.contrast_var.get(),
+            "grayscale": self.grayscale_var.get(),
+            "sepia": self.sepia_var.get(),
+            "invert": self.invert_var.get(),
+            "sharpen": self.sharpen_var.get(),
+            "blur": self.blur_var.get(),
+            "sketch": self.sketch_var.get(),
+            "cartoon": self.cartoon_var.get(),
+        }
+
+    def graph_for(self, source):
+        return self.full_graph if source is self.cv_image else self.preview_graph
 
     def resize_updated(self, event=None):
         scale = self.resize_var.get()
@@ -411,13 +1011,14 @@ class CropResizeApp:
         self.resize_var.set(scale)
         self.update_cropped_image()
 
-    def update_cropped_image(self):
+    def update_cropped_image(self, exact=True):
         if self.processed_image is None:
             return
         x1, x2 = sorted((self.crop_x1, self.crop_x2))
         y1, y2 = sorted((self.crop_y1, self.crop_y2))
 
-        h, w = self.processed_image.shape[:2]
+        # Crop coordinates are always in full resolution pixels
+        w, h = self.image_size
         x1 = max(0, min(w - 1, x1))
         x2 = max(0, min(w, x2))
         y1 = max(0, min(h - 1, y1))
@@ -425,156 +1026,45 @@ class CropResizeApp:
 
         if x2 <= x1 or y2 <= y1:
             self.crop_canvas.delete("all")
-            self.crop_canvas.create_text(225, 275, text="Invalid crop area", fill="red", font=("Arial", 14))
+            self.photo_cropped = None
+            self.crop_item = None
+            self.crop_canvas.create_text(225, 275, text="Invalid crop area", fill="red", font=("Arial", 14), tags="placeholder")
             return
 
-        cropped = self.processed_image[y1:y2, x1:x2]
         scale = self.resize_var.get()
-        new_w = max(1, int(cropped.shape[1] * scale / 100))
-        new_h = max(1, int(cropped.shape[0] * scale / 100))
-
-        resized = cv2.resize(cropped, (new_w, new_h), interpolation=cv2.INTER_AREA)
-
-        img_pil = Image.fromarray(resized)
-        self.photo_cropped = ImageTk.PhotoImage(img_pil)
-
-        self.crop_canvas.delete("all")
-        self.crop_canvas.config(width=new_w, height=new_h)
-        self.crop_canvas.create_image(0, 0, anchor=tk.NW, image=self.photo_cropped)
-
-    def mouse_crop_start(self, event):
-        if self.processed_image is None:
-            return
-        self.crop_coords_from_mouse = True
-        self.push_undo()
-        self.mouse_start_x = event.x
-        self.mouse_start_y = event.y
-        if self.mouse_rect:
-            self.orig_canvas.delete(self.mouse_rect)
-        self.mouse_rect = self.orig_canvas.create_rectangle(event.x, event.y, event.x, event.y, outline='red')
-
-    def mouse_crop_drag(self, event):
-        if self.processed_image is None or self.mouse_rect is None:
-            return
-        self.orig_canvas.coords(self.mouse_rect, self.mouse_start_x, self.mouse_start_y, event.x, event.y)
-
-    def mouse_crop_end(self, event):
-        if self.processed_image is None or self.mouse_rect is None:
-            return
-
-        x1, y1 = self.mouse_start_x, self.mouse_start_y
-        x2, y2 = event.x, event.y
-
-        x1 = max(0, min(self.display_img_width, x1))
-        x2 = max(0, min(self.display_img_width, x2))
-        y1 = max(0, min(self.display_img_height, y1))
-        y2 = max(0, min(self.display_img_height, y2))
-
-        x1, x2 = sorted([x1, x2])
-        y1, y2 = sorted([y1, y2])
-
-        img_h, img_w = self.processed_image.shape[:2]
-        scale_x = img_w / self.display_img_width
-        scale_y = img_h / self.display_img_height
-
-        self.crop_x1 = int(x1 * scale_x)
-        self.crop_x2 = int(x2 * scale_x)
-        self.crop_y1 = int(y1 * scale_y)
-        self.crop_y2 = int(y2 * scale_y)
-
-        # Update width and height entries based on crop
-        crop_w = self.crop_x2 - self.crop_x1
-        crop_h = self.crop_y2 - self.crop_y1
-        self.width_var.set(crop_w)
-        self.height_var.set(crop_h)
-        self.resize_var.set(100)
-
-        self.update_cropped_image()
-
-        self.orig_canvas.delete(self.mouse_rect)
-        self.mouse_rect = None
-
-    def push_undo(self):
-        state = (
-            self.crop_x1, self.crop_y1, self.crop_x2, self.crop_y2,
-            self.resize_var.get(), self.grayscale_var.get(),
-            self.sepia_var.get(), self.invert_var.get(),
-            self.sketch_var.get(), self.cartoon_var.get(),
-            self.sharpen_var.get(), self.hue_var.get(),
-            self.sat_var.get(), self.val_var.get(),
-            self.brightness_var.get(), self.contrast_var.get(),
-            self.blur_var.get(), self.rotation_var.get(),
-            self.width_var.get(), self.height_var.get(),
-            self.aspect_ratio_locked.get()
-        )
-        self.undo_stack.append(state)
-        self.redo_stack.clear()
-
-    def undo_crop(self):
-        if not self.undo_stack:
-            return
-        current_state = (
-            self.crop_x1, self.crop_y1, self.crop_x2, self.crop_y2,
-            self.resize_var.get(), self.grayscale_var.get(),
-            self.sepia_var.get(), self.invert_var.get(),
-            self.sketch_var.get(), self.cartoon_var.get(),
-            self.sharpen_var.get(), self.hue_var.get(),
-            self.sat_var.get(), self.val_var.get(),
-            self.brightness_var.get(), self.contrast_var.get(),
-            self.blur_var.get(), self.rotation_var.get(),
-            self.width_var.get(), self.height_var.get(),
-            self.aspect_ratio_locked.get()
-        )
-        self.redo_stack.append(current_state)
-        last_state = self.undo_stack.pop()
-        self.apply_state(last_state)
-
-    def redo_crop(self):
-        if not self.redo_stack:
-            return
-        current_state = (
-            self.crop_x1, self.crop_y1, self.crop_x2, self.crop_y2,
-            self.resize_var.get(), self.grayscale_var.get(),
-            self.sepia_var.get(), self.invert_var.get(),
-            self.sketch_var.get(), self.cartoon_var.get(),
-            self.sharpen_var.get(), self.hue_var.get(),
-            self.sat_var.get(), self.val_var.get(),
-            self.brightness_var.get(), self.contrast_var.get(),
-            self.blur_var.get(), self.rotation_var.get(),
-            self.width_var.get(), self.height_var.get(),
-            self.aspect_ratio_locked.get()
-        )
-        self.undo_stack.append(current_state)
-        next_state = self.redo_stack.pop()
-        self.apply_state(next_state)
+        new_w = max(1, int((x2 - x1) * scale / 100))
+        new_h = max(1, int((y2 - y1) * scale / 100))
+
+        ps = self.processed_scale
+        if exact and ps != 1.0 and self.cv_image is not None and (x2 - x1) * (y2 - y1) <= CROP_PREVIEW_MAX_PIXELS:
+            # Render just the crop region at full resolution in the background
+            params = self.filter_params()
+            key = ((x1, y1, x2, y2), tuple(sorted(params.items())))
+            if self.crop_region is not None and self.crop_region[0] == key:
+                self.show_cropped(self.crop_region[1], (new_w, new_h))
+                return
+            source = self.cv_image
+            self.crop_scheduler.submit(
+                lambda cancelled: pipeline.render_region(source, params, (x1, y1, x2, y2), cancelled=cancelled),
+                lambda region: self.crop_region_done(key, region))
+
+        # Map the crop onto the proxy when previewing
+        px1, py1 = int(x1 * ps), int(y1 * ps)
+        px2 = max(px1 + 1, int(round(x2 * ps)))
+        py2 = max(py1 + 1, int(round(y2 * ps)))
+        self.show_cropped(self.processed_image[py1:py2, px1:px2], (new_w, new_h))
+
+    def crop_region_done(self, key, region):
+        self.crop_region = (key, region)
+        scale = self.resize_var.get()
+        h, w = region.shape[:2]
+        self.show_cropped(region, (max(1, int(w * scale / 100)), max(1, int(h * scale / 100))))
 
-    def apply_state(self, state):
-        (x1, y1, x2, y2, resize, grayscale, sepia, invert, sketch, cartoon, sharpen,
-         hue, sat, val, brightness, contrast, blur, rotation, width, height, aspect_lock) = state
-        self.crop_coords_from_mouse = True
-        self.crop_x1 = x1
-        self.crop_y1 = y1
-        self.crop_x2 = x2
-        self.crop_y2 = y2
-        self.resize_var.set(resize)
-        self.grayscale_var.set(grayscale)
-        self.sepia_var.set(sepia)
-        self.invert_var.set(invert)
-        self.sketch_var.set(sketch)
-        self.cartoon_var.set(cartoon)
-        self.sharpen_var.set(sharpen)
-        self.hue_var.set(hue)
-        self.sat_var.set(sat)
-        self.val_var.set(val)
-        self.brightness_var.set(brightness)
-        self.contrast_var.set(contrast)
-        self.blur_var.set(blur)
-        self.rotation_var.set(rotation)
-        self.width_var.set(width)
-        self.height_var.set(height)
-        self.aspect_ratio_locked.set(aspect_lock)
-        self.apply_filters()
-        self.update_cropped_image()
+    def show_cropped(self, cropped, size):
+        self.crop_buffer = self.resize_for_display(cropped, size, self.crop_buffer)
+        self.crop_display_bytes = self.crop_buffer.nbytes
+        self.photo_cropped, self.crop_item = self.blit(
+            self.crop_canvas, self.photo_cropped, self.crop_item, self.crop_buffer)
 
     def show_help(self):
         help_text = (
@@ -584,10 +1074,12 @@ class CropResizeApp:
             "  Ctrl + Z : Undo\n"
             "  Ctrl + Y : Redo\n"
             "  Ctrl + R : Reset All\n"
+            "  Ctrl + 0 : Fit Image to View\n"
             "  Ctrl + Q : Exit\n\n"
             "Instructions:\n"
             " - Load an image.\n"
             " - Crop by dragging a rectangle on the original image.\n"
+            " - Zoom with the mouse wheel and pan by dragging with the right button.\n"
             " - Use sliders and checkboxes to apply filters and adjustments.\n"
             " - Resize cropped image by % or by Width and Height.\n"
             " - Use Undo/Redo to revert changes.\n"
@@ -604,27 +1096,153 @@ class CropResizeApp:
         if self.processed_image is None:
             messagebox.showwarning("No Image", "Load and crop an image first!")
             return
+        if self.export_thread is not None:
+            messagebox.showwarning("Export Running", "Wait for the current export to finish!")
+            return
 
         x1, x2 = sorted((self.crop_x1, self.crop_x2))
         y1, y2 = sorted((self.crop_y1, self.crop_y2))
 
-        cropped = self.processed_image[y1:y2, x1:x2]
-        if cropped.size == 0:
+        # Exports render only the crop region, at full resolution
+        full = self.ensure_full_image()
+        if full is None:
+            messagebox.showwarning("No Image", "The full resolution image could not be loaded!")
+            return
+        box = pipeline.clip_box((x1, y1, x2, y2), full.shape)
+        if box is None:
             messagebox.showwarning("Invalid Crop", "Crop area is invalid!")
             return
-
         file_path = filedialog.asksaveasfilename(defaultextension=".png",
-                                                 filetypes=[("PNG files", "*.png"), ("JPEG files", "*.jpg *.jpeg")])
+                                                 filetypes=[("PNG files", "*.png"), ("JPEG files", "*.jpg *.jpeg"),
+                                                            ("WebP files", "*.webp")])
         if not file_path:
             return
+        options = self.ask_export_options(file_path)
+        if options is None:
+            return
 
-        scale = self.resize_var.get()
-        new_w = max(1, int(cropped.shape[1] * scale / 100))
-        new_h = max(1, int(cropped.shape[0] * scale / 100))
-        resized = cv2.resize(cropped, (new_w, new_h), interpolation=cv2.INTER_AREA)
-
-        cv2.imwrite(file_path, cv2.cvtColor(resized, cv2.COLOR_RGB2BGR))
-        messagebox.showinfo("Saved", f"Image saved to {file_path}")
+        # Settings are read here; the export thread only sees the snapshot
+        progress = [0, "Rendering"]
+        result = []
+        self.export_thread = threading.Thread(
+            target=self.export_image,
+            args=(full, self.filter_params(), box, self.resize_var.get(), file_path, options, progress, result),
+            daemon=True)
+        self.export_thread.start()
+        self.save_btn.config(state=tk.DISABLED)
+        self.export_bar.grid()
+        self.export_label.grid()
+        self.check_export(file_path, progress, result)
+
+    def export_image(self, full, params, box, resize, file_path, options, progress, result):
+        # Runs on the export thread; progress and result are read by check_export
+        error = RuntimeError("Export was interrupted")
+        try:
+            resized = pipeline.render_export(full, params, box, resize)
+            progress[:] = [70, "Encoding"]
+            pipeline.save_rgb(file_path, resized, options)
+            progress[:] = [100, "Done"]
+            error = None
+        except Exception as e:
+            error = e
+        finally:
+            # Whatever happened, check_export gets a result and re-enables Save
+            result.append(error)
+
+    def check_export(self, file_path, progress, result):
+        self.export_bar.config(value=progress[0])
+        self.export_label.config(text=f"{progress[1]}...")
+        if not result:
+            self.root.after(50, self.check_export, file_path, progress, result)
+            return
+        self.export_thread = None
+        self.export_bar.grid_remove()
+        self.export_label.grid_remove()
+        self.save_btn.config(state=tk.NORMAL)
+        if result[0] is not None:
+            messagebox.showerror("Save Failed", str(result[0]))
+        else:
+            messagebox.showinfo("Saved", f"Image saved to {file_path}")
+
+    def ask_export_options(self, file_path):
+        # Modal dialog with the encoder settings for the chosen format.
+        # Returns the options for save_rgb, or None if cancelled.
+        ext = os.path.splitext(file_path)[1].lower()
+        options = dict(self.export_options)
+
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Export Options")
+        dialog.transient(self.root)
+        dialog.resizable(False, False)
+        frame = ttk.Frame(dialog, padding=10)
+        frame.pack(fill=tk.BOTH, expand=True)
+
+        preset_var = tk.StringVar(value=self.export_preset)
+        png_var = tk.IntVar(value=options["png_compression"])
+        jpeg_quality_var = tk.IntVar(value=options["jpeg_quality"])
+        progressive_var = tk.BooleanVar(value=options["jpeg_progressive"])
+        webp_quality_var = tk.IntVar(value=options["webp_quality"])
+        lossless_var = tk.BooleanVar(value=options["webp_lossless"])
+
+        def apply_preset(event=None):
+            options.update(pipeline.EXPORT_PRESETS[EXPORT_PRESET_LABELS[preset_var.get()]])
+            png_var.set(options["png_compression"])
+            jpeg_quality_var.set(options["jpeg_quality"])
+            progressive_var.set(options["jpeg_progressive"])
+            webp_quality_var.set(options["webp_quality"])
+            lossless_var.set(options["webp_lossless"])
+
+        ttk.Label(frame, text="Preset").grid(row=0, column=0, sticky="w")
+        preset_box = ttk.Combobox(frame, textvariable=preset_var, values=list(EXPORT_PRESET_LABELS),
+                                  state="readonly", width=16)
+        preset_box.grid(row=0, column=1, sticky="w", pady=2)
+        preset_box.bind("<<ComboboxSelected>>", apply_preset)
+
+        if ext == ".png":
+            ttk.Label(frame, text="PNG Compression (0-9)").grid(row=1, column=0, sticky="w")
+            ttk.Scale(frame, from_=0, to=9, orient=tk.HORIZONTAL, variable=png_var, length=160).grid(row=1, column=1, pady=2)
+        elif ext in (".jpg", ".jpeg"):
+            ttk.Label(frame, text="JPEG Quality").grid(row=1, column=0, sticky="w")
+            ttk.Scale(frame, from_=1, to=100, orient=tk.HORIZONTAL, variable=jpeg_quality_var, length=160).grid(row=1, column=1, pady=2)
+            ttk.Checkbutton(frame, text="Progressive JPEG", variable=progressive_var).grid(row=2, column=0, columnspan=2, sticky="w")
+        elif ext == ".webp":
+            ttk.Label(frame, text="WebP Quality").grid(row=1, column=0, sticky="w")
+            ttk.Scale(frame, from_=1, to=100, orient=tk.HORIZONTAL, variable=webp_quality_var, length=160).grid(row=1, column=1, pady=2)
+            ttk.Checkbutton(frame, text="Lossless WebP", variable=lossless_var).grid(row=2, column=0, columnspan=2, sticky="w")
+
+        result = []
+
+        def accept():
+            options.update(png_compression=png_var.get(), jpeg_quality=jpeg_quality_var.get(),
+                           jpeg_progressive=progressive_var.get(), webp_quality=webp_quality_var.get(),
+                           webp_lossless=lossless_var.get())
+            result.append(options)
+            dialog.destroy()
+
+        button_frame = ttk.Frame(frame)
+        button_frame.grid(row=3, column=0, columnspan=2, pady=(8, 0))
+        ttk.Button(button_frame, text="Save", command=accept).pack(side=tk.LEFT, padx=4)
+        ttk.Button(button_frame, text="Cancel", command=dialog.destroy).pack(side=tk.LEFT, padx=4)
+
+        dialog.grab_set()
+        self.root.wait_window(dialog)
+        if not result:
+            return None
+        self.export_preset = preset_var.get()
+        self.export_options = options
+        return options
+
+    def save_recipe(self):
+        # Recipe files are read by Batch_Processor.py
+        if self.proxy_image is None:
+            return
+        file_path = filedialog.asksaveasfilename(defaultextension=".json",
+                                                 filetypes=[("Recipe files", "*.json")])
+        if not file_path:
+            return
+        with open(file_path, "w") as f:
+            json.dump(pipeline.recipe_from_state(self.current_state()), f, indent=2)
+        messagebox.showinfo("Saved", f"Recipe saved to {file_path}")
 
     # Keyboard shortcuts
     def on_keypress(self, event):
@@ -652,6 +1270,9 @@ class CropResizeApp:
         self.push_undo()
         self.mouse_start_x = event.x
         self.mouse_start_y = event.y
+        self.mouse_end = (event.x, event.y)
+        self.interacting = True
+        self.crop_scheduler.cancel()
         if self.mouse_rect:
             self.orig_canvas.delete(self.mouse_rect)
         self.mouse_rect = self.orig_canvas.create_rectangle(event.x, event.y, event.x, event.y, outline='red')
@@ -660,14 +1281,33 @@ class CropResizeApp:
         if self.processed_image is None or self.mouse_rect is None:
             return
         self.orig_canvas.coords(self.mouse_rect, self.mouse_start_x, self.mouse_start_y, event.x, event.y)
-
-    def mouse_crop_end(self, event):
+        # Motion events are coalesced into at most one preview per interval
+        self.mouse_end = (event.x, event.y)
+        if self.crop_drag_job is None:
+            self.crop_drag_job = self.root.after(CROP_DRAG_INTERVAL, self.preview_crop_drag)
+
+    def preview_crop_drag(self):
+        # Crops the displayed proxy render and shows it scaled to the crop
+        # canvas; the exact crop is made when the button is released
+        self.crop_drag_job = None
         if self.processed_image is None or self.mouse_rect is None:
             return
-
-        x1, y1 = self.mouse_start_x, self.mouse_start_y
-        x2, y2 = event.x, event.y
-
+        x1, y1, x2, y2 = self.display_to_image(self.mouse_start_x, self.mouse_start_y, *self.mouse_end)
+        if x2 <= x1 or y2 <= y1:
+            return
+        ps = self.processed_scale
+        px1, py1 = int(x1 * ps), int(y1 * ps)
+        px2 = max(px1 + 1, int(round(x2 * ps)))
+        py2 = max(py1 + 1, int(round(y2 * ps)))
+        width = max(10, self.crop_canvas.winfo_width())
+        height = max(10, self.crop_canvas.winfo_height())
+        fit = min(1.0, width / (x2 - x1), height / (y2 - y1))
+        size = (max(1, int((x2 - x1) * fit)), max(1, int((y2 - y1) * fit)))
+        self.show_cropped(self.processed_image[py1:py2, px1:px2], size)
+
+    def display_to_image(self, x1, y1, x2, y2):
+        # Maps a rectangle on orig_canvas to full resolution pixels through
+        # the same view transform show_original_image drew with
         x1 = max(0, min(self.display_img_width, x1))
         x2 = max(0, min(self.display_img_width, x2))
         y1 = max(0, min(self.display_img_height, y1))
@@ -676,14 +1316,23 @@ class CropResizeApp:
         x1, x2 = sorted([x1, x2])
         y1, y2 = sorted([y1, y2])
 
-        img_h, img_w = self.processed_image.shape[:2]
-        scale_x = img_w / self.display_img_width
-        scale_y = img_h / self.display_img_height
+        # Edges snap to the nearest pixel boundary
+        img_w, img_h = self.image_size
+        scale = self.view_scale
+        return (min(img_w, int(self.view_x + x1 / scale + 0.5)), min(img_h, int(self.view_y + y1 / scale + 0.5)),
+                min(img_w, int(self.view_x + x2 / scale + 0.5)), min(img_h, int(self.view_y + y2 / scale + 0.5)))
 
-        self.crop_x1 = int(x1 * scale_x)
-        self.crop_x2 = int(x2 * scale_x)
-        self.crop_y1 = int(y1 * scale_y)
-        self.crop_y2 = int(y2 * scale_y)
+    def mouse_crop_end(self, event):
+        if self.processed_image is None or self.mouse_rect is None:
+            return
+
+        if self.crop_drag_job is not None:
+            self.root.after_cancel(self.crop_drag_job)
+            self.crop_drag_job = None
+        self.interacting = False
+
+        self.crop_x1, self.crop_y1, self.crop_x2, self.crop_y2 = self.display_to_image(
+            self.mouse_start_x, self.mouse_start_y, event.x, event.y)
 
         # Update width and height entries based on crop
         crop_w = self.crop_x2 - self.crop_x1
@@ -697,8 +1346,8 @@ class CropResizeApp:
         self.orig_canvas.delete(self.mouse_rect)
         self.mouse_rect = None
 
-    def push_undo(self):
-        state = (
+    def current_state(self):
+        return (
             self.crop_x1, self.crop_y1, self.crop_x2, self.crop_y2,
             self.resize_var.get(), self.grayscale_var.get(),
             self.sepia_var.get(), self.invert_var.get(),
@@ -710,24 +1359,16 @@ class CropResizeApp:
             self.width_var.get(), self.height_var.get(),
             self.aspect_ratio_locked.get()
         )
+
+    def push_undo(self):
+        state = self.current_state()
         self.undo_stack.append(state)
         self.redo_stack.clear()
 
     def undo_crop(self):
         if not self.undo_stack:
             return
-        current_state = (
-            self.crop_x1, self.crop_y1, self.crop_x2, self.crop_y2,
-            self.resize_var.get(), self.grayscale_var.get(),
-            self.sepia_var.get(), self.invert_var.get(),
-            self.sketch_var.get(), self.cartoon_var.get(),
-            self.sharpen_var.get(), self.hue_var.get(),
-            self.sat_var.get(), self.val_var.get(),
-            self.brightness_var.get(), self.contrast_var.get(),
-            self.blur_var.get(), self.rotation_var.get(),
-            self.width_var.get(), self.height_var.get(),
-            self.aspect_ratio_locked.get()
-        )
+        current_state = self.current_state()
         self.redo_stack.append(current_state)
         last_state = self.undo_stack.pop()
         self.apply_state(last_state)
@@ -735,23 +1376,48 @@ class CropResizeApp:
     def redo_crop(self):
         if not self.redo_stack:
             return
-        current_state = (
-            self.crop_x1, self.crop_y1, self.crop_x2, self.crop_y2,
-            self.resize_var.get(), self.grayscale_var.get(),
-            self.sepia_var.get(), self.invert_var.get(),
-            self.sketch_var.get(), self.cartoon_var.get(),
-            self.sharpen_var.get(), self.hue_var.get(),
-            self.sat_var.get(), self.val_var.get(),
-            self.brightness_var.get(), self.contrast_var.get(),
-            self.blur_var.get(), self.rotation_var.get(),
-            self.width_var.get(), self.height_var.get(),
-            self.aspect_ratio_locked.get()
-        )
+        current_state = self.current_state()
         self.undo_stack.append(current_state)
         next_state = self.redo_stack.pop()
         self.apply_state(next_state)
 
+    def apply_state(self, state):
+        (x1, y1, x2, y2, resize, grayscale, sepia, invert, sketch, cartoon, sharpen,
+         hue, sat, val, brightness, contrast, blur, rotation, width, height, aspect_lock) = state
+        self.crop_coords_from_mouse = True
+        self.crop_x1 = x1
+        self.crop_y1 = y1
+        self.crop_x2 = x2
+        self.crop_y2 = y2
+        self.resize_var.set(resize)
+        self.grayscale_var.set(grayscale)
+        self.sepia_var.set(sepia)
+        self.invert_var.set(invert)
+        self.sketch_var.set(sketch)
+        self.cartoon_var.set(cartoon)
+        self.sharpen_var.set(sharpen)
+        self.hue_var.set(hue)
+        self.sat_var.set(sat)
+        self.val_var.set(val)
+        self.brightness_var.set(brightness)
+        self.contrast_var.set(contrast)
+        self.blur_var.set(blur)
+        self.rotation_var.set(rotation)
+        self.width_var.set(width)
+        self.height_var.set(height)
+        self.aspect_ratio_locked.set(aspect_lock)
+        # The crop preview is refreshed by show_processed, once the render
+        # (or the render cache) has the new processed image
+        self.apply_filters()
+
+def report_startup(app):
+    # --startup-report: print the startup timings as JSON and quit, for
+    # Benchmark_Startup.py
+    print(json.dumps({name: seconds * 1000 for name, seconds in app.startup_times.items()}), flush=True)
+    app.root.destroy()
+
+
 if __name__ == "__main__":
     root = tk.Tk()
-    app = CropResizeApp(root)
+    app = CropResizeApp(root, on_ready=report_startup if "--startup-report" in sys.argv[1:] else None)
     root.mainloop()
\ No newline at end of file
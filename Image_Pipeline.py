@@ -0,0 +1,950 @@
+import functools
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Filter chain shared by the editor and headless tools. Every stage takes a
+# uint8 image and returns a new one (or the input untouched), so cached
+# outputs can be handed to the next stage without copying. Images are RGB,
+# except that plan_pipeline keeps a grayscale image as one channel for as
+# long as the stages after it allow. Intermediates a stage throws away come
+# from SCRATCH, a pool of reusable buffers.
+
+SEPIA_KERNEL = np.array([[0.393, 0.769, 0.189],
+                         [0.349, 0.686, 0.168],
+                         [0.272, 0.534, 0.131]])
+
+SHARPEN_KERNEL = np.array([[0, -1, 0],
+                           [-1, 5, -1],
+                           [0, -1, 0]])
+
+DEFAULT_PARAMS = {
+    "rotation": 0,
+    "hue": 0,
+    "sat": 0,
+    "val": 0,
+    "brightness": 0,
+    "contrast": 1.0,
+    "grayscale": False,
+    "sepia": False,
+    "invert": False,
+    "sharpen": False,
+    "blur": 0,
+    "sketch": False,
+    "cartoon": False,
+    "quality": "exact",  # "fast" approximates the sketch and cartoon effects
+}
+
+
+def scaled_ksize(size, scale):
+    # Gaussian kernels shrink with the image so proxies look like the full render
+    ksize = max(1, int(round(size * scale)))
+    if ksize % 2 == 0:
+        ksize += 1
+    return ksize
+
+
+# Rotation rows are warped a band at a time with cv2.remap. The maps are
+# built from absolute output coordinates, so warping any region of the
+# output gives exactly the pixels of the whole-frame warp.
+WARP_BAND_ROWS = 128
+
+
+def rotation_inverse(shape, angle):
+    h, w = shape[:2]
+    M = cv2.getRotationMatrix2D((w/2, h/2), angle, 1)
+    return cv2.invertAffineTransform(M)
+
+
+def warp_region(img, inverse, box):
+    x1, y1, x2, y2 = box
+    out = np.empty((y2 - y1, x2 - x1) + img.shape[2:], dtype=img.dtype)
+    xs = np.arange(x1, x2, dtype=np.float64)
+    ax = inverse[0, 0] * xs
+    bx = inverse[1, 0] * xs
+    for b0 in range(y1, y2, WARP_BAND_ROWS):
+        b1 = min(y2, b0 + WARP_BAND_ROWS)
+        ys = np.arange(b0, b1, dtype=np.float64)[:, None]
+        map_x = (ax + (inverse[0, 1] * ys + inverse[0, 2])).astype(np.float32)
+        map_y = (bx + (inverse[1, 1] * ys + inverse[1, 2])).astype(np.float32)
+        cv2.remap(img, map_x, map_y, cv2.INTER_LINEAR, dst=out[b0 - y1:b1 - y1],
+                  borderMode=cv2.BORDER_CONSTANT)
+    return out
+
+
+def rotate(img, params, scale=1.0):
+    angle = params["rotation"]
+    if angle == 0:
+        return img
+    h, w = img.shape[:2]
+    return warp_region(img, rotation_inverse(img.shape, angle), (0, 0, w, h))
+
+
+# Point operations (HSV offsets, brightness/contrast, grayscale, sepia and
+# invert) depend only on each pixel, so they are compiled into lookup tables.
+# Every table is built by running the original operation over a 0..255 ramp,
+# which keeps the fused result bit-identical to running the steps one by one.
+
+RAMP = np.arange(256, dtype=np.uint8)
+
+
+@functools.lru_cache(maxsize=32)
+def compile_point_ops(hue, sat, val, brightness, contrast, grayscale, sepia, invert):
+    # Tables that would leave every pixel as it is come back as None.
+    # HSV offsets are one 3-channel table applied in HSV space; with no
+    # offsets the RGB -> HSV -> RGB round trip is skipped altogether.
+    hsv_lut = None
+    if hue or sat or val:
+        ramp = RAMP.astype(np.float32)
+        h = ((ramp + hue) % 180).astype(np.uint8)
+        s = np.clip(ramp + sat * 2.55, 0, 255).astype(np.uint8)
+        v = np.clip(ramp + val * 2.55, 0, 255).astype(np.uint8)
+        hsv_lut = cv2.merge([h, s, v]).reshape(256, 1, 3)
+
+    bc_lut = None
+    if brightness or contrast != 1.0:
+        bc_lut = cv2.convertScaleAbs(RAMP, alpha=contrast, beta=brightness).reshape(256, 1)
+    invert_lut = 255 - RAMP
+
+    if grayscale:
+        # After grayscale all three channels are equal, so sepia and invert
+        # reduce to a table indexed by the gray level
+        gray_rgb = cv2.merge([RAMP, RAMP, RAMP]).reshape(256, 1, 3)
+        if sepia:
+            gray_rgb = cv2.transform(gray_rgb, SEPIA_KERNEL)
+        if invert:
+            gray_rgb = 255 - gray_rgb
+        post_lut = gray_rgb if (sepia or invert) else None
+        return hsv_lut, bc_lut, post_lut
+
+    if sepia:
+        # Sepia mixes channels, so invert runs as its own table afterwards
+        post_lut = invert_lut.reshape(256, 1) if invert else None
+        return hsv_lut, bc_lut, post_lut
+
+    if invert:
+        bc_lut = invert_lut[bc_lut] if bc_lut is not None else invert_lut.reshape(256, 1)
+    return hsv_lut, bc_lut, None
+
+
+def point_ops(img, params, scale=1.0):
+    # All 8-bit table lookups, done in place on the stage's one output array
+    hsv_lut, bc_lut, post_lut = compile_point_ops(
+        params["hue"], params["sat"], params["val"],
+        params["brightness"], params["contrast"],
+        bool(params["grayscale"]), bool(params["sepia"]), bool(params["invert"]))
+
+    out = None
+    if hsv_lut is not None:
+        out = cv2.cvtColor(img, cv2.COLOR_RGB2HSV)
+        cv2.LUT(out, hsv_lut, dst=out)
+        cv2.cvtColor(out, cv2.COLOR_HSV2RGB, dst=out)
+    if bc_lut is not None:
+        out = cv2.LUT(img if out is None else out, bc_lut, dst=out)
+
+    if params["grayscale"]:
+        gray = cv2.cvtColor(img if out is None else out, cv2.COLOR_RGB2GRAY, dst=SCRATCH.take(img.shape[:2]))
+        out = cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB, dst=out)
+        SCRATCH.give(gray)
+    elif params["sepia"]:
+        out = cv2.transform(img if out is None else out, SEPIA_KERNEL)
+
+    if post_lut is not None:
+        cv2.LUT(out, post_lut, dst=out)
+    return img if out is None else out
+
+
+def gray_point_ops(img, params, scale=1.0):
+    # point_ops for grayscale without sepia, whose three output channels are
+    # equal: returns the one gray channel instead
+    hsv_lut, bc_lut, post_lut = compile_point_ops(
+        params["hue"], params["sat"], params["val"],
+        params["brightness"], params["contrast"], True, False, bool(params["invert"]))
+
+    src = img
+    if hsv_lut is not None:
+        src = cv2.cvtColor(img, cv2.COLOR_RGB2HSV, dst=SCRATCH.take(img.shape))
+        cv2.LUT(src, hsv_lut, dst=src)
+        cv2.cvtColor(src, cv2.COLOR_HSV2RGB, dst=src)
+    if bc_lut is not None:
+        src = cv2.LUT(src, bc_lut, dst=SCRATCH.take(img.shape) if src is img else src)
+    gray = cv2.cvtColor(src, cv2.COLOR_RGB2GRAY)
+    if src is not img:
+        SCRATCH.give(src)
+    if params["invert"]:
+        cv2.bitwise_not(gray, dst=gray)
+    return gray
+
+
+def sharpen(img, params, scale=1.0):
+    if not params["sharpen"]:
+        return img
+    return cv2.filter2D(img, -1, SHARPEN_KERNEL)
+
+
+def blur(img, params, scale=1.0):
+    if params["blur"] <= 0:
+        return img
+    ksize = scaled_ksize(params["blur"], scale)
+    return cv2.GaussianBlur(img, (ksize, ksize), 0)
+
+
+# Fast effects run their heavy smoothing at half resolution. The 2x2 grid
+# starts at even coordinates (odd edges are reflected), so a region that
+# starts on an even row and column smooths exactly the same pixels as the
+# whole frame and region renders stay exact.
+
+# Both return pooled buffers (double_scale a view of one) for the caller
+# to give back to SCRATCH.
+
+def half_scale(img):
+    h, w = img.shape[:2]
+    if h % 2 or w % 2:
+        img = cv2.copyMakeBorder(img, 0, h % 2, 0, w % 2, cv2.BORDER_REFLECT)
+    half = SCRATCH.take((img.shape[0] // 2, img.shape[1] // 2) + img.shape[2:])
+    return cv2.resize(img, (half.shape[1], half.shape[0]), dst=half, interpolation=cv2.INTER_AREA)
+
+
+def double_scale(img, shape):
+    up = SCRATCH.take((img.shape[0] * 2, img.shape[1] * 2) + img.shape[2:])
+    cv2.resize(img, (up.shape[1], up.shape[0]), dst=up, interpolation=cv2.INTER_LINEAR)
+    return up[:shape[0], :shape[1]]
+
+
+def sketch(img, params, scale=1.0):
+    if not params["sketch"]:
+        return img
+    if img.ndim == 2:
+        gray = img  # Already gray, see plan_pipeline
+    else:
+        gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY, dst=SCRATCH.take(img.shape[:2]))
+    inv = cv2.bitwise_not(gray, dst=SCRATCH.take(gray.shape))
+    if params["quality"] == "fast":
+        ksize = scaled_ksize(21, scale / 2)
+        half = half_scale(inv)
+        cv2.GaussianBlur(half, (ksize, ksize), 0, dst=half)
+        blurred = double_scale(half, inv.shape)
+        SCRATCH.give(half)
+    else:
+        ksize = scaled_ksize(21, scale)
+        blurred = cv2.GaussianBlur(inv, (ksize, ksize), 0, dst=SCRATCH.take(inv.shape))
+    inv_blur = cv2.bitwise_not(blurred, dst=blurred)
+    result = cv2.divide(gray, inv_blur, scale=256.0, dst=inv)
+    out = cv2.cvtColor(result, cv2.COLOR_GRAY2RGB)
+    SCRATCH.give(inv, blurred)
+    if gray is not img:
+        SCRATCH.give(gray)
+    return out
+
+
+def cartoon(img, params, scale=1.0):
+    if not params["cartoon"]:
+        return img
+    # Simple cartoon effect
+    img_gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY, dst=SCRATCH.take(img.shape[:2]))
+    if params["quality"] == "fast":
+        half = half_scale(img_gray)
+        median = cv2.medianBlur(half, 3, dst=SCRATCH.take(half.shape))
+        img_blur = double_scale(median, img_gray.shape)
+        SCRATCH.give(half, median)
+    else:
+        img_blur = cv2.medianBlur(img_gray, 7, dst=SCRATCH.take(img_gray.shape))
+    edges = cv2.adaptiveThreshold(img_blur, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
+                                  cv2.THRESH_BINARY, 9, 2, dst=img_gray)
+    if params["quality"] == "fast":
+        # Half the diameter at half the resolution covers the same area
+        half = half_scale(img)
+        smoothed = cv2.bilateralFilter(half, 5, 300, 300, dst=SCRATCH.take(half.shape))
+        color = double_scale(smoothed, img.shape)
+        SCRATCH.give(half, smoothed)
+    else:
+        color = cv2.bilateralFilter(img, 9, 300, 300, dst=SCRATCH.take(img.shape))
+    out = cv2.bitwise_and(color, color, mask=edges)
+    SCRATCH.give(img_gray, img_blur, color)
+    return out
+
+
+def to_rgb(img, params, scale=1.0):
+    return cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
+
+
+# (name, function, parameters the stage reads) in render order
+STAGES = [
+    ("rotation", rotate, ("rotation",)),
+    ("point_ops", point_ops, ("hue", "sat", "val", "brightness", "contrast",
+                              "grayscale", "sepia", "invert")),
+    ("sharpen", sharpen, ("sharpen",)),
+    ("blur", blur, ("blur",)),
+    ("sketch", sketch, ("sketch", "quality")),
+    ("cartoon", cartoon, ("cartoon", "quality")),
+]
+
+
+def plan_pipeline(params):
+    # The (name, function, keys) steps that render params, giving the same
+    # pixels as running every stage in STAGES:
+    # - stages at their identity settings are left out;
+    # - grayscale without sepia gives three equal channels, so point_ops
+    #   returns the one gray channel, sharpen and blur filter only that, and
+    #   sketch takes it as the gray it would have computed. to_rgb expands
+    #   it back before cartoon or at the end.
+    steps = []
+    gray = False
+    for name, func, keys in STAGES:
+        if name == "rotation":
+            if params["rotation"] == 0:
+                continue
+        elif name == "point_ops":
+            luts = compile_point_ops(
+                params["hue"], params["sat"], params["val"],
+                params["brightness"], params["contrast"],
+                bool(params["grayscale"]), bool(params["sepia"]), bool(params["invert"]))
+            if params["grayscale"] and not params["sepia"]:
+                func = gray_point_ops
+                gray = True
+            elif all(lut is None for lut in luts) and not (params["grayscale"] or params["sepia"]):
+                continue
+        elif name == "blur":
+            if params["blur"] <= 0:
+                continue
+        elif not params[name]:
+            continue
+        if gray and name == "cartoon":
+            steps.append(("to_rgb", to_rgb, ()))
+        gray = gray and name not in ("sketch", "cartoon")
+        steps.append((name, func, keys))
+    if gray:
+        steps.append(("to_rgb", to_rgb, ()))
+    return steps
+
+
+def apply_pipeline(img, params, scale=1.0):
+    params = dict(DEFAULT_PARAMS, **params)
+    for name, func, keys in plan_pipeline(params):
+        img = func(img, params, scale)
+    return img
+
+
+# Region and tiled execution. A region of the processed frame is rendered
+# from the same region of the source grown by a halo: the rows and columns
+# of context every neighborhood filter after rotation needs. Pixels inside
+# the region then match the whole-frame render exactly, so exports only pay
+# for the crop and tiles can bound working memory.
+
+# Rows of context each stage needs on either side of a band
+STAGE_HALOS = {
+    "rotation": lambda params, scale: 0,
+    "point_ops": lambda params, scale: 0,
+    "to_rgb": lambda params, scale: 0,
+    "sharpen": lambda params, scale: 1 if params["sharpen"] else 0,
+    "blur": lambda params, scale: scaled_ksize(params["blur"], scale) // 2 if params["blur"] > 0 else 0,
+    "sketch": lambda params, scale: sketch_halo(params, scale) if params["sketch"] else 0,
+    # medianBlur(7) feeds adaptiveThreshold(9); bilateralFilter(9) needs less.
+    # Fast: a half resolution median(3) and upscale, doubled, plus the 2x2
+    # pairing, then adaptiveThreshold(9)
+    "cartoon": lambda params, scale: (2 * (1 + 1) + 2 + 4 if params["quality"] == "fast" else 3 + 4)
+                                     if params["cartoon"] else 0,
+}
+
+
+def sketch_halo(params, scale):
+    if params["quality"] == "fast":
+        # Half resolution blur radius plus one half pixel for the upscale,
+        # doubled, plus the 2x2 pairing
+        return 2 * (scaled_ksize(21, scale / 2) // 2 + 1) + 2
+    return scaled_ksize(21, scale) // 2
+
+# Working copies a band needs while passing through the chain, in units of
+# the band's own size. Used to turn a byte budget into a band height.
+BAND_WORKING_COPIES = 8
+
+DEFAULT_TILE_BUDGET = 256 * 1024 * 1024
+
+# OpenCV's SIMD loops process each row in fixed-width blocks and finish the
+# row with a scalar tail, and the float conversions (HSV2RGB among them) can
+# differ by one level between the two paths. Regions therefore start on a
+# multiple of this many columns and end on one or at the image edge, so
+# every pixel takes the same path as in the whole-frame render.
+REGION_ALIGN = 128
+
+
+def pipeline_halo(params, scale=1.0):
+    return sum(STAGE_HALOS[name](params, scale) for name, func, keys in plan_pipeline(params))
+
+
+def band_rows(shape, halo, budget):
+    # Rows per band so a band and its halo fit in budget. A band is never
+    # shorter than its two halos, or each output row would re-render up to
+    # 2 * halo + 1 source rows; with a budget too small for that (strong
+    # filters on wide images) the budget is exceeded instead, and the
+    # rendered rows stay within three times the output.
+    row_bytes = shape[1] * (shape[2] if len(shape) > 2 else 1) * BAND_WORKING_COPIES
+    return max(1, 2 * halo, budget // row_bytes - 2 * halo)
+
+
+def render_region(img, params, box, scale=1.0, cancelled=None):
+    # Same pixels as apply_pipeline(img, params, scale)[y1:y2, x1:x2].
+    # Returns None if cancelled between stages.
+    params = dict(DEFAULT_PARAMS, **params)
+    h, w = img.shape[:2]
+    x1, y1, x2, y2 = box
+    halo = pipeline_halo(params, scale)
+    ex1 = max(0, x1 - halo) // REGION_ALIGN * REGION_ALIGN
+    ex2 = min(w, -(-(x2 + halo) // REGION_ALIGN) * REGION_ALIGN)
+    # Rows start even as well, for the half resolution grid of the fast effects
+    ey1, ey2 = max(0, y1 - halo) // 2 * 2, min(h, y2 + halo)
+
+    if params["rotation"] != 0:
+        inverse = rotation_inverse(img.shape, params["rotation"])
+        region = warp_region(img, inverse, (ex1, ey1, ex2, ey2))
+    else:
+        region = img[ey1:ey2, ex1:ex2]
+    for name, func, keys in plan_pipeline(params):
+        if name == "rotation":
+            continue
+        if cancelled is not None and cancelled():
+            return None
+        region = func(region, params, scale)
+    return region[y1 - ey1:y2 - ey1, x1 - ex1:x2 - ex1]
+
+
+def render_tiled(img, params, scale=1.0, budget=DEFAULT_TILE_BUDGET, cancelled=None, box=None):
+    # Renders box (default: the whole frame) as bands of rows so working
+    # memory stays near budget on top of the source and the output (see
+    # band_rows for budgets too small for the halo). Returns None if
+    # cancelled between bands.
+    params = dict(DEFAULT_PARAMS, **params)
+    h, w = img.shape[:2]
+    x1, y1, x2, y2 = box if box is not None else (0, 0, w, h)
+    halo = pipeline_halo(params, scale)
+    rows = band_rows((y2 - y1, x2 - x1) + img.shape[2:], halo, budget)
+
+    out = np.empty((y2 - y1, x2 - x1) + img.shape[2:], dtype=img.dtype)
+    for y0 in range(y1, y2, rows):
+        if cancelled is not None and cancelled():
+            return None
+        b1 = min(y2, y0 + rows)
+        out[y0 - y1:b1 - y1] = render_region(img, params, (x1, y0, x2, b1), scale)
+    return out
+
+
+# Field order of the editor's undo/redo state tuple (CropResizeApp.current_state)
+STATE_FIELDS = (
+    "crop_x1", "crop_y1", "crop_x2", "crop_y2",
+    "resize", "grayscale",
+    "sepia", "invert",
+    "sketch", "cartoon",
+    "sharpen", "hue",
+    "sat", "val",
+    "brightness", "contrast",
+    "blur", "rotation",
+    "width", "height",
+    "aspect_lock",
+)
+
+
+def recipe_from_state(state):
+    return dict(zip(STATE_FIELDS, state))
+
+
+def crop_box(recipe, shape):
+    # Crop coordinates default to the whole image when the recipe has none
+    h, w = shape[:2]
+    x1, x2 = sorted((recipe.get("crop_x1", 0), recipe.get("crop_x2", w)))
+    y1, y2 = sorted((recipe.get("crop_y1", 0), recipe.get("crop_y2", h)))
+    return x1, y1, x2, y2
+
+
+def clip_box(box, shape):
+    # Clips like slicing processed[y1:y2, x1:x2] would; None if nothing is left
+    h, w = shape[:2]
+    x1, y1, x2, y2 = box
+    x1, x2 = min(max(0, x1), w), min(max(0, x2), w)
+    y1, y2 = min(max(0, y1), h), min(max(0, y2), h)
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return x1, y1, x2, y2
+
+
+def resize_crop(cropped, resize):
+    # Same INTER_AREA resize the editor uses when saving
+    new_w = max(1, int(cropped.shape[1] * resize / 100))
+    new_h = max(1, int(cropped.shape[0] * resize / 100))
+    return cv2.resize(cropped, (new_w, new_h), interpolation=cv2.INTER_AREA)
+
+
+# Stages that give the same look at any scale: per-pixel operations, and
+# blur, whose radius is scaled. The others are tuned to full resolution
+# pixels, so a chain using them is not rendered at the export scale.
+SCALE_INVARIANT_STAGES = ("point_ops", "blur", "to_rgb")
+
+
+def render_export(img, params, box, resize, budget=None):
+    # The exported image: box of the processed frame, resized to resize
+    # percent. Only the crop region is rendered. With a budget it runs tiled;
+    # the output is identical either way. Rotated downscales whose filters
+    # are all scale invariant take resample_export; enlargements keep the
+    # two passes, as filtering at the enlarged size costs more than the
+    # second resample.
+    if resize <= 0:
+        raise ValueError(f"resize must be a positive percentage, got {resize}")
+    if params.get("rotation", 0) != 0 and resize < 100:
+        filters = dict(DEFAULT_PARAMS, **dict(params, rotation=0))
+        if all(name in SCALE_INVARIANT_STAGES for name, _, _ in plan_pipeline(filters)):
+            return resample_export(img, params, box, resize, budget)
+    if budget is None:
+        cropped = render_region(img, params, box)
+    else:
+        cropped = render_tiled(img, params, budget=budget, box=box)
+    return resize_crop(cropped, resize)
+
+
+def resample_export(img, params, box, resize, budget=None):
+    # Rotation, crop and resize composed into one warp from the source onto
+    # the output grid, so there is one interpolation instead of two and the
+    # filters never see pixels the resize would throw away. They run at the
+    # export scale instead, as in the editor's proxies. Below 50% the warp
+    # is done at a whole multiple of the output size and box averaged down,
+    # so every source pixel still contributes.
+    params = dict(DEFAULT_PARAMS, **params)
+    x1, y1, x2, y2 = box
+    out_w = max(1, int((x2 - x1) * resize / 100))
+    out_h = max(1, int((y2 - y1) * resize / 100))
+    k = max(1, math.ceil(50 / resize))
+    w, h = out_w * k, out_h * k
+    sx, sy = w / (x2 - x1), h / (y2 - y1)
+    scale = (sx + sy) / 2
+
+    filters = dict(params, rotation=0)
+    halo = pipeline_halo(filters, scale)
+    # Context for the filters, up to the edge of the rotated frame
+    fh, fw = img.shape[:2]
+    left, top = min(halo, int(x1 * sx)), min(halo, int(y1 * sy))
+    right, bottom = min(halo, int((fw - x2) * sx)), min(halo, int((fh - y2) * sy))
+
+    # Grid pixel (u, v) samples the rotated frame at x1 + (u - left + 0.5) / sx - 0.5
+    # (and likewise for y), the pixel centre convention of cv2.resize
+    grid = np.array([[1 / sx, 0, x1 + (0.5 - left) / sx - 0.5],
+                     [0, 1 / sy, y1 + (0.5 - top) / sy - 0.5],
+                     [0, 0, 1]])
+    M = rotation_inverse(img.shape, params["rotation"]) @ grid
+    warped = cv2.warpAffine(img, M, (left + w + right, top + h + bottom),
+                            flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_CONSTANT)
+
+    inner = (left, top, left + w, top + h)
+    if budget is None:
+        out = render_region(warped, filters, inner, scale)
+    else:
+        out = render_tiled(warped, filters, scale, budget, box=inner)
+    if k > 1:
+        out = cv2.resize(out, (out_w, out_h), interpolation=cv2.INTER_AREA)
+    return out
+
+
+def render_recipe(img, recipe, budget=None):
+    box = clip_box(crop_box(recipe, img.shape), img.shape)
+    if box is None:
+        return None
+    return render_export(img, recipe, box, recipe.get("resize", 100), budget)
+
+
+def load_rgb(path):
+    img = cv2.imread(path)
+    if img is None:
+        raise ValueError(f"Could not read image {path}")
+    # Convert in place rather than allocating a second full-size array
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=img)
+
+
+EXIF_ORIENTATION = 0x0112
+
+REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+def image_size(path):
+    # (width, height) as imread will return it, read from the header only
+    with Image.open(path) as img:
+        w, h = img.size
+        if img.getexif().get(EXIF_ORIENTATION, 1) in (5, 6, 7, 8):
+            w, h = h, w
+    return w, h
+
+
+def load_rgb_reduced(path, size, target):
+    # JPEGs can be decoded at 1/2, 1/4 or 1/8 scale directly by libjpeg.
+    # Picks the smallest decode that still covers an image of size fitted
+    # into target, or returns None when no reduced decode applies.
+    if not path.lower().endswith((".jpg", ".jpeg")):
+        return None
+    w, h = size
+    scale = min(target[0] / w, target[1] / h)
+    for factor, flag in REDUCED_DECODE_FLAGS:
+        if factor * scale <= 1.0:
+            img = cv2.imread(path, flag)
+            if img is None:
+                return None
+            return cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=img)
+    return None
+
+
+# Encoder settings for exports. "default" passes no parameters, so files
+# come out exactly as from a plain cv2.imwrite (its values are the ones the
+# export dialog shows for it); "fastest" skips PNG deflate and uses lossy
+# WebP; "smallest" trades encode time for size (lossy WebP too).
+EXPORT_PRESETS = {
+    "default": {"png_compression": 1, "jpeg_quality": 95, "jpeg_progressive": False,
+                "jpeg_optimize": False, "webp_quality": 100, "webp_lossless": True},
+    "fastest": {"png_compression": 0, "jpeg_quality": 95, "jpeg_progressive": False,
+                "jpeg_optimize": False, "webp_quality": 80, "webp_lossless": False},
+    "smallest": {"png_compression": 9, "jpeg_quality": 80, "jpeg_progressive": True,
+                 "jpeg_optimize": True, "webp_quality": 75, "webp_lossless": False},
+}
+
+
+# Options each format reads
+FORMAT_OPTIONS = {
+    ".png": ("png_compression",),
+    ".jpg": ("jpeg_quality", "jpeg_progressive", "jpeg_optimize"),
+    ".jpeg": ("jpeg_quality", "jpeg_progressive", "jpeg_optimize"),
+    ".webp": ("webp_quality", "webp_lossless"),
+}
+
+
+def encode_params(ext, options):
+    # cv2.imwrite/imencode parameters for the format with this extension.
+    # Settings left at the default preset pass nothing: an explicit PNG
+    # compression level, for one, also changes zlib's strategy.
+    ext = ext.lower()
+    default = EXPORT_PRESETS["default"]
+    if all(options[name] == default[name] for name in FORMAT_OPTIONS.get(ext, ())):
+        return []
+    if ext == ".png":
+        return [cv2.IMWRITE_PNG_COMPRESSION, int(options["png_compression"])]
+    if ext in (".jpg", ".jpeg"):
+        return [cv2.IMWRITE_JPEG_QUALITY, int(options["jpeg_quality"]),
+                cv2.IMWRITE_JPEG_PROGRESSIVE, int(bool(options["jpeg_progressive"])),
+                cv2.IMWRITE_JPEG_OPTIMIZE, int(bool(options["jpeg_optimize"]))]
+    if ext == ".webp":
+        # Qualities above 100 select lossless WebP
+        quality = 101 if options["webp_lossless"] else int(options["webp_quality"])
+        return [cv2.IMWRITE_WEBP_QUALITY, quality]
+    return []
+
+
+def save_rgb(path, img, options=None):
+    params = encode_params(os.path.splitext(path)[1], options) if options is not None else []
+    if not cv2.imwrite(path, cv2.cvtColor(img, cv2.COLOR_RGB2BGR), params):
+        raise ValueError(f"Could not write image {path}")
+
+
+def decode_rgb(data):
+    # load_rgb for an encoded image held in memory
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Could not decode image")
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=img)
+
+
+def encode_rgb(img, ext, options=None):
+    # save_rgb to memory; returns the encoded bytes as a uint8 array
+    params = encode_params(ext, options) if options is not None else []
+    ok, buf = cv2.imencode(ext, cv2.cvtColor(img, cv2.COLOR_RGB2BGR), params)
+    if not ok:
+        raise ValueError(f"Could not encode image as {ext}")
+    return buf
+
+
+class ImageCache:
+    # Least recently used cache of rendered images, bounded by total bytes
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.nbytes = 0
+
+    def get(self, key):
+        img = self.entries.get(key)
+        if img is not None:
+            self.entries.move_to_end(key)
+        return img
+
+    def put(self, key, img):
+        if img.nbytes > self.budget:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.nbytes -= old.nbytes
+        self.entries[key] = img
+        self.nbytes += img.nbytes
+        while self.nbytes > self.budget:
+            key, evicted = self.entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def arrays(self):
+        return list(self.entries.values())
+
+    def evict(self, nbytes):
+        # Drops least recently used entries until nbytes are freed or none are left
+        while nbytes > 0 and self.entries:
+            key, evicted = self.entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            nbytes -= evicted.nbytes
+
+
+class ImagePyramid:
+    # Successive 2x INTER_AREA reductions of one image for display. Levels
+    # are built the first time a zoom needs them.
+
+    def __init__(self, img):
+        self.base = img
+        self.levels = [img]
+
+    def level_for(self, zoom):
+        # The smallest level with at least zoom times the base resolution,
+        # and its width and height relative to the base. Zooms of 1 and
+        # above get the base itself.
+        base_h, base_w = self.base.shape[:2]
+        i = 0
+        while True:
+            if i + 1 == len(self.levels):
+                h, w = self.levels[i].shape[:2]
+                if w < 2 or h < 2:
+                    break
+                self.levels.append(cv2.resize(self.levels[i], (w // 2, h // 2), interpolation=cv2.INTER_AREA))
+            if self.levels[i + 1].shape[1] / base_w < zoom:
+                break
+            i += 1
+        level = self.levels[i]
+        return level, level.shape[1] / base_w, level.shape[0] / base_h
+
+    def arrays(self):
+        return self.levels[1:]
+
+    def evict(self, nbytes):
+        # Reduced levels are rebuilt on demand
+        del self.levels[1:]
+
+
+class BufferPool:
+    # Free scratch arrays by shape and dtype. take() hands out a free one or
+    # a new one, give() takes arrays back (a view returns the array it was
+    # cut from). Free arrays beyond budget bytes are dropped, least recently
+    # given first. Safe to share between render threads.
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.free = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+    def take(self, shape, dtype=np.uint8):
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self.lock:
+            arrays = self.free.get(key)
+            if arrays:
+                arr = arrays.pop()
+                if not arrays:
+                    del self.free[key]
+                self.nbytes -= arr.nbytes
+                return arr
+        return np.empty(shape, dtype)
+
+    def give(self, *arrays):
+        with self.lock:
+            for arr in arrays:
+                if arr.base is not None:
+                    arr = arr.base
+                key = (arr.shape, arr.dtype.str)
+                self.free.setdefault(key, []).append(arr)
+                self.free.move_to_end(key)
+                self.nbytes += arr.nbytes
+            while self.nbytes > self.budget:
+                key, oldest = next(iter(self.free.items()))
+                self.nbytes -= oldest.pop(0).nbytes
+                if not oldest:
+                    del self.free[key]
+
+    def clear(self):
+        with self.lock:
+            self.free.clear()
+            self.nbytes = 0
+
+    def arrays(self):
+        with self.lock:
+            return [arr for arrays in self.free.values() for arr in arrays]
+
+    def evict(self, nbytes):
+        with self.lock:
+            while nbytes > 0 and self.free:
+                key, oldest = next(iter(self.free.items()))
+                arr = oldest.pop(0)
+                if not oldest:
+                    del self.free[key]
+                self.nbytes -= arr.nbytes
+                nbytes -= arr.nbytes
+
+
+SCRATCH_BUDGET = 256 * 1024 * 1024
+SCRATCH = BufferPool(SCRATCH_BUDGET)
+
+
+class FilterGraph:
+    # Runs the planned stages over one source image and remembers each stage's
+    # last output keyed by its own parameters and its input, so changing a
+    # late stage only reruns the stages after it. With a tile_budget, sources
+    # whose untiled working set would exceed it are rendered tiled and not
+    # cached.
+
+    def __init__(self, tile_budget=None):
+        self.source = None
+        self.cache = {}
+        self.lock = threading.Lock()
+        self.tile_budget = tile_budget
+
+    def needs_tiling(self, source):
+        return (self.tile_budget is not None
+                and source.nbytes * BAND_WORKING_COPIES > self.tile_budget)
+
+    def clear(self):
+        with self.lock:
+            self.source = None
+            self.cache.clear()
+
+    def arrays(self):
+        # A snapshot; a render may be adding outputs meanwhile
+        return [img for key, img in list(self.cache.values())]
+
+    def evict(self, nbytes):
+        # Everything goes, but not while a render holds the graph
+        if self.lock.acquire(blocking=False):
+            try:
+                self.cache.clear()
+            finally:
+                self.lock.release()
+
+    def render(self, source, params, scale=1.0, cancelled=None, timings=None):
+        # cancelled is polled between stages; a cancelled render returns None
+        # but keeps the stages it finished cached for the next request.
+        # timings, if given, gets a (stage, seconds, bytes) entry for every
+        # stage that actually ran, bytes being the size of its new output.
+        params = dict(DEFAULT_PARAMS, **params)
+        with self.lock:
+            if source is not self.source:
+                self.source = source
+                self.cache.clear()
+            if self.needs_tiling(source):
+                start = time.perf_counter()
+                img = render_tiled(source, params, scale, self.tile_budget, cancelled)
+                if timings is not None and img is not None:
+                    timings.append(("tiled", time.perf_counter() - start, img.nbytes))
+                return img
+
+            img = source
+            key = ("source", scale)
+            steps = plan_pipeline(params)
+            # Outputs of stages the plan dropped can never match again
+            for name in set(self.cache) - set(name for name, func, keys in steps):
+                del self.cache[name]
+            for name, func, keys in steps:
+                key = (key, name, tuple(params[k] for k in keys))
+                cached = self.cache.get(name)
+                if cached is not None and cached[0] == key:
+                    img = cached[1]
+                    continue
+                if cancelled is not None and cancelled():
+                    return None
+                start = time.perf_counter()
+                out = func(img, params, scale)
+                if timings is not None:
+                    timings.append((name, time.perf_counter() - start, 0 if out is img else out.nbytes))
+                img = out
+                self.cache[name] = (key, img)
+            return img
+
+
+def owner(arr):
+    # The array that owns arr's memory
+    while isinstance(arr.base, np.ndarray):
+        arr = arr.base
+    return arr
+
+
+class MemoryManager:
+    # Accounts for the large arrays an application holds against one budget.
+    # Images are reported by a function returning the ones currently held;
+    # caches are objects with arrays() and evict(nbytes). Arrays that share
+    # memory (one image under several names, views, cached stage outputs
+    # that are also on screen) are counted once. While the total is over
+    # budget, caches are evicted in the order they were added.
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.images = []
+        self.caches = []
+
+    def add_images(self, name, images):
+        self.images.append((name, images))
+
+    def add_cache(self, name, cache):
+        # cache may also be a function returning the current cache, or None
+        self.caches.append((name, cache))
+
+    def usage(self):
+        # [(name, bytes)] for the images, then each cache. A buffer shared
+        # by several holders counts for the first.
+        seen = set()
+        usage = []
+
+        def count(arrays):
+            total = 0
+            for arr in arrays:
+                if arr is None:
+                    continue
+                arr = owner(arr)
+                if id(arr) not in seen:
+                    seen.add(id(arr))
+                    total += arr.nbytes
+            return total
+
+        for name, images in self.images:
+            usage.append((name, count(images())))
+        for name, cache in self.caches:
+            cache = cache() if callable(cache) else cache
+            usage.append((name, count(cache.arrays()) if cache is not None else 0))
+        return usage
+
+    def enforce(self):
+        # Evicts caches until the total fits the budget or no cache is left
+        # to evict. Returns the usage afterwards.
+        usage = self.usage()
+        for name, cache in self.caches:
+            excess = sum(nbytes for n, nbytes in usage) - self.budget
+            if excess <= 0:
+                break
+            cache = cache() if callable(cache) else cache
+            if cache is not None:
+                cache.evict(excess)
+                usage = self.usage()
+        return usage
+
+
+def share(img):
+    # Makes img read only so several holders can keep it without copies:
+    # whoever wants to change it has to copy it first
+    if img is not None:
+        img.flags.writeable = False
+    return img
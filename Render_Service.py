@@ -0,0 +1,359 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Pool
+from urllib.parse import parse_qsl, urlsplit
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from Image_Pipeline import (BAND_WORKING_COPIES, DEFAULT_PARAMS, EXPORT_PRESETS, ImageCache,
+                            clip_box, crop_box, decode_rgb, encode_rgb, pipeline_halo, render_recipe)
+
+# Serves the editor's crop/resize/filter pipeline over HTTP on localhost, for
+# frontends that cannot use the Tk app. POST an encoded image to /render with
+# the recipe fields (the ones push_undo records) as query parameters:
+#
+#   curl --data-binary @photo.jpg -o out.png \
+#       "http://127.0.0.1:8137/render?hue=30&blur=5&crop_x1=0&crop_y1=0&crop_x2=800&crop_y2=600"
+#
+# "format" (.png, .jpg, .webp, .bmp) and "preset" pick the encoder. Renders
+# run in a pool of worker processes started and warmed up once. Results are
+# cached by a hash of the image bytes and the request, so a repeated request
+# is answered without rendering. Values outside the editor's slider ranges
+# are rejected, each request is checked against a memory limit before it is
+# decoded, and renders within the limit run tiled.
+#
+# "python Render_Service.py load-test" replays a request against a running
+# service and reports throughput and latency percentiles.
+
+DEFAULT_PORT = 8137
+CONTENT_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg",
+                 ".webp": "image/webp", ".bmp": "image/bmp"}
+
+# Recipe fields that are not filter parameters; everything else is typed
+# like DEFAULT_PARAMS
+RECIPE_TYPES = dict({name: type(value) for name, value in DEFAULT_PARAMS.items()},
+                    crop_x1=int, crop_y1=int, crop_x2=int, crop_y2=int,
+                    resize=int, width=int, height=int, aspect_lock=bool)
+
+# Allowed values of the numeric fields, the ranges of the editor's sliders.
+# Larger blurs and resizes would make one request hold a worker for minutes.
+RECIPE_RANGES = dict(hue=(-180, 180), sat=(-100, 100), val=(-100, 100), brightness=(-100, 100),
+                     contrast=(0.1, 3.0), blur=(0, 20), rotation=(-180, 180), resize=(10, 200))
+
+
+def parse_value(name, text):
+    kind = RECIPE_TYPES[name]
+    if kind is bool:
+        if text.lower() in ("1", "true", "yes", "on"):
+            return True
+        if text.lower() in ("0", "false", "no", "off"):
+            return False
+        raise ValueError(f"{name} must be true or false")
+    value = kind(text)
+    if name in RECIPE_RANGES:
+        low, high = RECIPE_RANGES[name]
+        # Written so that nan fails as well
+        if not low <= value <= high:
+            raise ValueError(f"{name} must be between {low} and {high}")
+    return value
+
+
+def parse_request(query):
+    # (recipe, ext, options) from the query string; ValueError if invalid
+    recipe = {}
+    ext = ".png"
+    preset = "default"
+    for name, text in parse_qsl(query):
+        if name == "format":
+            ext = text if text.startswith(".") else "." + text
+            if ext.lower() not in CONTENT_TYPES:
+                raise ValueError(f"unsupported format {text}")
+        elif name == "preset":
+            if text not in EXPORT_PRESETS:
+                raise ValueError(f"unknown preset {text}")
+            preset = text
+        elif name in RECIPE_TYPES:
+            recipe[name] = parse_value(name, text)
+        else:
+            raise ValueError(f"unknown parameter {name}")
+    return recipe, ext.lower(), EXPORT_PRESETS[preset]
+
+
+def request_memory(size, recipe):
+    # Bytes a render holds at minimum: the decoded image and the resized
+    # output, plus the working copies of one tiled band. A band is at least
+    # 16 rows and at least two halos (see band_rows), and is rendered with
+    # a halo of context on every side.
+    w, h = size
+    box = clip_box(crop_box(recipe, (h, w)), (h, w))
+    if box is None:
+        return w * h * 3
+    x1, y1, x2, y2 = box
+    resize = recipe.get("resize", 100) / 100
+    output = int((x2 - x1) * resize) * int((y2 - y1) * resize) * 3
+    halo = pipeline_halo(dict(DEFAULT_PARAMS, **recipe))
+    band = (x2 - x1 + 2 * halo) * 3 * (max(16, 2 * halo) + 2 * halo) * BAND_WORKING_COPIES
+    return w * h * 3 + output + band
+
+
+def request_key(data, recipe, ext, options):
+    # Content address: the image bytes and the parsed request, so equivalent
+    # query strings ("hue=30&blur=5", "blur=5&hue=30") share an entry
+    digest = hashlib.sha256(data)
+    digest.update(json.dumps([recipe, ext, options], sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def init_worker():
+    # One OpenCV thread per process, the pool already uses every core. The
+    # warm-up render builds the lookup tables and loads OpenCV's kernels.
+    cv2.setNumThreads(1)
+    warm = np.zeros((64, 64, 3), np.uint8)
+    render_recipe(warm, dict(hue=10, brightness=10, sharpen=True, blur=3, sketch=True))
+    encode_rgb(warm, ".png")
+
+
+def render_job(data, recipe, ext, options, budget):
+    # Runs in a worker process; returns (encoded array, milliseconds)
+    start = time.perf_counter()
+    result = render_recipe(decode_rgb(data), recipe, budget)
+    if result is None:
+        raise ValueError("crop area is empty for this image")
+    return encode_rgb(result, ext, options), (time.perf_counter() - start) * 1000
+
+
+class RenderService(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, workers=None, cache_bytes=256 * 1024 * 1024,
+                 memory_limit=1024 * 1024 * 1024, max_upload=64 * 1024 * 1024, max_pending=None):
+        super().__init__(address, RenderHandler)
+        self.pool = Pool(workers, initializer=init_worker)
+        workers = workers or os.cpu_count() or 1
+        self.memory_limit = memory_limit
+        self.max_upload = max_upload
+        # Requests beyond this many in flight are turned away with 503
+        self.slots = threading.BoundedSemaphore(max_pending or 4 * workers)
+        self.cache = ImageCache(cache_bytes)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "cache_hits": 0, "rendered": 0, "rejected": 0, "failed": 0}
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def server_close(self):
+        super().server_close()
+        self.pool.terminate()
+        self.pool.join()
+
+
+class RenderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, status, message, count="rejected"):
+        self.server.count(count)
+        self.send_json(status, {"error": message})
+
+    def reject_unread(self, status, message):
+        # The body was not read, so the connection cannot carry another request
+        self.close_connection = True
+        self.send_error_json(status, message)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/health":
+            self.send_json(200, {"status": "ok"})
+        elif path == "/stats":
+            with self.server.lock:
+                stats = dict(self.server.stats, cache_bytes=self.server.cache.nbytes,
+                             cache_entries=len(self.server.cache.entries))
+            self.send_json(200, stats)
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        server = self.server
+        url = urlsplit(self.path)
+        if url.path != "/render":
+            self.reject_unread(404, "not found")
+            return
+        server.count("requests")
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            self.reject_unread(400, "Content-Length must be a whole number of bytes")
+            return
+        if length <= 0:
+            self.reject_unread(400, "request body must be an encoded image")
+            return
+        if length > server.max_upload:
+            self.reject_unread(413, f"upload is {length} bytes, limit is {server.max_upload}")
+            return
+        data = self.rfile.read(length)
+
+        try:
+            recipe, ext, options = parse_request(url.query)
+        except ValueError as e:
+            self.send_error_json(400, str(e))
+            return
+
+        key = request_key(data, recipe, ext, options)
+        with server.lock:
+            cached = server.cache.get(key)
+        if cached is not None:
+            server.count("cache_hits")
+            self.send_image(cached, ext, "hit", 0.0)
+            return
+
+        # Memory check from the header, before anything is decoded
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                size = img.size
+        except Exception:
+            self.send_error_json(400, "could not read image header")
+            return
+        needed = request_memory(size, recipe)
+        if needed > server.memory_limit:
+            self.send_error_json(413, f"render needs about {needed // 2**20} MB, "
+                                      f"limit is {server.memory_limit // 2**20} MB")
+            return
+
+        if not server.slots.acquire(blocking=False):
+            self.send_error_json(503, "too many requests in flight")
+            return
+        try:
+            # Whatever the limit leaves after the decoded image bounds the tiles
+            budget = server.memory_limit - size[0] * size[1] * 3
+            encoded, render_ms = server.pool.apply(render_job, (data, recipe, ext, options, budget))
+        except Exception as e:
+            self.send_error_json(422, str(e), count="failed")
+            return
+        finally:
+            server.slots.release()
+
+        server.count("rendered")
+        with server.lock:
+            server.cache.put(key, encoded)
+        self.send_image(encoded, ext, "miss", render_ms)
+
+    def send_image(self, encoded, ext, cache, render_ms):
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPES[ext])
+        self.send_header("Content-Length", str(encoded.nbytes))
+        self.send_header("X-Cache", cache)
+        self.send_header("X-Render-Ms", f"{render_ms:.1f}")
+        self.end_headers()
+        self.wfile.write(memoryview(encoded))
+
+
+def load_test(url, image_path, requests, concurrency, vary=False):
+    # Posts image_path to url requests times from concurrency threads. With
+    # vary, each request gets its own hue so the cache cannot answer it.
+    with open(image_path, "rb") as f:
+        data = f.read()
+
+    def one(i):
+        target = url
+        if vary:
+            target += ("&" if "?" in url else "?") + f"hue={i % 360 - 180}"
+        req = urllib.request.Request(target, data=data, method="POST")
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req) as response:
+                response.read()
+                status, cache = response.status, response.headers.get("X-Cache")
+        except urllib.error.HTTPError as e:
+            status, cache = e.code, None
+        except OSError:
+            status, cache = 0, None
+        return (time.perf_counter() - start) * 1000, status, cache
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [ms for ms, status, cache in results if status == 200]
+    statuses = {}
+    for ms, status, cache in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    report = {
+        "requests": requests,
+        "concurrency": concurrency,
+        "elapsed_s": elapsed,
+        "requests_per_s": requests / elapsed if elapsed > 0 else 0.0,
+        "statuses": statuses,
+        "cache_hits": sum(1 for ms, status, cache in results if cache == "hit"),
+    }
+    if latencies:
+        report.update({f"p{q}_ms": float(np.percentile(latencies, q)) for q in (50, 90, 99)})
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local HTTP service for the Image Editor pipeline.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="Run the service")
+    serve.add_argument("--host", default="127.0.0.1", help="Address to bind (default: %(default)s, local only)")
+    serve.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU)")
+    serve.add_argument("--cache", type=int, default=256, metavar="MB", help="Result cache size (default: 256)")
+    serve.add_argument("--memory-limit", type=int, default=1024, metavar="MB",
+                       help="Memory a single render may use; larger requests get 413 (default: 1024)")
+    serve.add_argument("--max-upload", type=int, default=64, metavar="MB", help="Largest accepted upload (default: 64)")
+    serve.add_argument("--max-pending", type=int, default=None,
+                       help="Renders in flight before requests get 503 (default: 4 per worker)")
+
+    test = commands.add_parser("load-test", help="Measure a running service")
+    test.add_argument("image", help="Image file to post")
+    test.add_argument("--url", default=f"http://127.0.0.1:{DEFAULT_PORT}/render",
+                      help="Render URL, query string included (default: %(default)s)")
+    test.add_argument("--requests", type=int, default=100)
+    test.add_argument("--concurrency", type=int, default=8)
+    test.add_argument("--vary", action="store_true", help="Give every request its own hue to bypass the cache")
+    args = parser.parse_args(argv)
+
+    if args.command == "load-test":
+        json.dump(load_test(args.url, args.image, args.requests, args.concurrency, args.vary), sys.stdout, indent=2)
+        print()
+        return 0
+
+    server = RenderService((args.host, args.port), args.workers, args.cache * 1024 * 1024,
+                           args.memory_limit * 1024 * 1024, args.max_upload * 1024 * 1024, args.max_pending)
+    print(f"Serving on http://{args.host}:{args.port}/render", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
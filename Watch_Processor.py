@@ -0,0 +1,278 @@
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+import cv2
+
+from Batch_Processor import find_images
+from Image_Pipeline import EXPORT_PRESETS, load_rgb, render_recipe, save_rgb
+
+# Watches a directory and applies an editor recipe (saved with "Save Recipe"
+# in Image_Editor_App.py) to every image that arrives, for scanners that keep
+# dropping files into a folder. Decode, filter and encode run as separate
+# stages, each with its own worker threads (OpenCV releases the GIL), joined
+# by bounded queues. When a stage falls behind, the queues in front of it
+# fill up and the earlier stages wait, so a burst of files waits on disk
+# instead of in memory.
+
+STOP = None  # Queue sentinel, one per worker of the receiving stage
+
+
+class Stage:
+    # A pool of worker threads taking items from inbox, passing each through
+    # func and putting the result into outbox. Items are (src, dst, data);
+    # func returns the new data, and errors are recorded as failures.
+
+    def __init__(self, name, func, inbox, outbox, workers, metrics):
+        self.name = name
+        self.func = func
+        self.inbox = inbox
+        self.outbox = outbox
+        self.metrics = metrics
+        self.threads = [threading.Thread(target=self.run, daemon=True) for _ in range(workers)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        # Lets the workers finish what is queued, then waits for them
+        for _ in self.threads:
+            self.inbox.put(STOP)
+        for thread in self.threads:
+            thread.join()
+
+    def run(self):
+        while True:
+            item = self.inbox.get()
+            if item is STOP:
+                return
+            src, dst, data = item
+            self.metrics.add(self.name, busy=1)
+            try:
+                result = self.func(src, dst, data)
+            except Exception as e:
+                self.metrics.fail(src, f"{self.name}: {e}")
+                continue
+            finally:
+                self.metrics.add(self.name, busy=-1)
+            if self.outbox is not None:
+                self.outbox.put((src, dst, result))
+            else:
+                self.metrics.add("done")
+
+
+class Metrics:
+    # Counters shared by the stages, reported every interval
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {"queued": 0, "skipped": 0, "done": 0, "failed": 0}
+        self.busy = {}
+        self.failures = []
+
+    def add(self, name, busy=None):
+        with self.lock:
+            if busy is None:
+                self.counts[name] += 1
+            else:
+                self.busy[name] = self.busy.get(name, 0) + busy
+
+    def fail(self, src, error):
+        with self.lock:
+            self.counts["failed"] += 1
+            self.failures.append((src, error))
+        print(f"Failed: {src}: {error}", file=sys.stderr)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts), dict(self.busy)
+
+
+class FolderScanner:
+    # Finds images that are new in input_dir. A file counts as arrived once
+    # its size and modification time are the same on two scans in a row, so
+    # files still being written are left alone. An empty file that has not
+    # changed for empty_timeout seconds is given up on and returned as stale.
+
+    def __init__(self, input_dir, empty_timeout=30.0):
+        self.input_dir = input_dir
+        self.empty_timeout = empty_timeout
+        self.pending = {}  # path: (signature, time it was first seen)
+        self.seen = set()
+
+    def scan(self):
+        # (paths ready to process, empty paths that timed out)
+        ready = []
+        stale = []
+        pending = {}
+        now = time.monotonic()
+        for path in find_images(self.input_dir):
+            if path in self.seen:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            signature = (st.st_size, st.st_mtime)
+            previous, since = self.pending.get(path, (None, now))
+            if previous != signature:
+                since = now
+            if st.st_size > 0 and previous == signature:
+                self.seen.add(path)
+                ready.append(path)
+            elif st.st_size == 0 and now - since >= self.empty_timeout:
+                self.seen.add(path)
+                stale.append(path)
+            else:
+                pending[path] = (signature, since)
+        self.pending = pending
+        return ready, stale
+
+
+def output_path(src, output_dir, ext):
+    return os.path.join(output_dir, os.path.splitext(os.path.basename(src))[0] + ext)
+
+
+def is_current(src, dst):
+    # Output written after the input was last changed, e.g. before a restart
+    try:
+        return os.stat(dst).st_mtime >= os.stat(src).st_mtime
+    except OSError:
+        return False
+
+
+def report(metrics, queues, stages, start, last, out=None):
+    counts, busy = metrics.snapshot()
+    now = time.perf_counter()
+    record = {
+        "time": time.time(),
+        "elapsed": round(now - start, 3),
+        "rate": round((counts["done"] - last[1]) / (now - last[0]), 3) if now > last[0] else 0.0,
+        "queues": {name: q.qsize() for name, q in queues.items()},
+        "busy": {stage.name: busy.get(stage.name, 0) for stage in stages},
+    }
+    record.update(counts)
+    print(f"{record['done']} done, {record['failed']} failed, {record['rate']:.2f} images/sec, queues " +
+          " ".join(f"{name}={q.qsize()}/{q.maxsize}" for name, q in queues.items()),
+          file=sys.stderr)
+    if out is not None:
+        out.write(json.dumps(record) + "\n")
+        out.flush()
+    return now, counts["done"]
+
+
+def watch(input_dir, output_dir, recipe, ext=".png", options=None, budget=None,
+          decode_workers=2, filter_workers=None, encode_workers=2, queue_size=4,
+          interval=1.0, stats_interval=5.0, metrics_file=None, once=False, empty_timeout=30.0):
+    # Runs until interrupted, or with once=True until every image already in
+    # input_dir is written. Returns the Metrics.
+    os.makedirs(output_dir, exist_ok=True)
+    # One OpenCV thread per filter worker, the workers already use every core
+    cv2.setNumThreads(1)
+    metrics = Metrics()
+    queues = {"decode": queue.Queue(queue_size), "filter": queue.Queue(queue_size),
+              "encode": queue.Queue(queue_size)}
+
+    def decode(src, dst, data):
+        return load_rgb(src)
+
+    def apply(src, dst, img):
+        result = render_recipe(img, recipe, budget)
+        if result is None:
+            raise ValueError("crop area is empty for this image")
+        return result
+
+    def encode(src, dst, result):
+        save_rgb(dst, result, options)
+
+    stages = [
+        Stage("decode", decode, queues["decode"], queues["filter"], decode_workers, metrics),
+        Stage("filter", apply, queues["filter"], queues["encode"], filter_workers or os.cpu_count() or 1, metrics),
+        Stage("encode", encode, queues["encode"], None, encode_workers, metrics),
+    ]
+    for stage in stages:
+        stage.start()
+
+    out = open(metrics_file, "a") if metrics_file else None
+    scanner = FolderScanner(input_dir, empty_timeout)
+    start = time.perf_counter()
+    last = (start, 0)
+    next_report = start + stats_interval
+    try:
+        while True:
+            ready, stale = scanner.scan()
+            for src in stale:
+                metrics.add("queued")
+                metrics.fail(src, f"still empty after {empty_timeout:g}s")
+            for src in ready:
+                dst = output_path(src, output_dir, ext)
+                if is_current(src, dst):
+                    metrics.add("skipped")
+                    continue
+                metrics.add("queued")
+                # Blocks while the pipeline is full, which is the backpressure
+                queues["decode"].put((src, dst, None))
+            if time.perf_counter() >= next_report:
+                last = report(metrics, queues, stages, start, last, out)
+                next_report += stats_interval
+            if once and not scanner.pending:
+                counts, busy = metrics.snapshot()
+                if counts["done"] + counts["failed"] == counts["queued"]:
+                    break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("Stopping, finishing queued images...", file=sys.stderr)
+    finally:
+        for stage in stages:
+            stage.stop()
+        report(metrics, queues, stages, start, last, out)
+        if out is not None:
+            out.close()
+    return metrics
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply an Image Editor recipe to images as they arrive in a directory.")
+    parser.add_argument("input_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("--recipe", required=True,
+                        help="JSON recipe saved from the editor. Crop coordinates are in pixels and are clipped to each image.")
+    parser.add_argument("--ext", default=".png", choices=[".png", ".jpg", ".jpeg", ".bmp", ".webp"],
+                        help="Output file extension (default: .png, like the editor)")
+    parser.add_argument("--preset", default="default", choices=sorted(EXPORT_PRESETS),
+                        help="Encoder settings: default, fastest (write speed) or smallest (file size)")
+    parser.add_argument("--decode-workers", type=int, default=2, help="Decoder threads (default: 2)")
+    parser.add_argument("--filter-workers", type=int, default=None, help="Filter threads (default: one per CPU)")
+    parser.add_argument("--encode-workers", type=int, default=2, help="Encoder threads (default: 2)")
+    parser.add_argument("--queue-size", type=int, default=4,
+                        help="Images each queue between stages may hold before earlier stages wait (default: 4)")
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds between directory scans (default: 1)")
+    parser.add_argument("--stats-interval", type=float, default=5.0,
+                        help="Seconds between throughput and queue depth reports (default: 5)")
+    parser.add_argument("--metrics", help="Also append each report as a JSON line to this file")
+    parser.add_argument("--memory-budget", type=int, default=None, metavar="MB",
+                        help="Process each image in tiles using about this much working memory per filter thread "
+                             "(more when strong filters on wide images need it)")
+    parser.add_argument("--once", action="store_true",
+                        help="Process the images already in the directory, then exit")
+    parser.add_argument("--empty-timeout", type=float, default=30.0,
+                        help="Seconds an empty file may stay empty before it counts as failed (default: 30)")
+    args = parser.parse_args(argv)
+
+    with open(args.recipe) as f:
+        recipe = json.load(f)
+
+    budget = args.memory_budget * 1024 * 1024 if args.memory_budget else None
+    metrics = watch(args.input_dir, args.output_dir, recipe, args.ext, EXPORT_PRESETS[args.preset], budget,
+                    args.decode_workers, args.filter_workers, args.encode_workers, args.queue_size,
+                    args.interval, args.stats_interval, args.metrics, args.once, args.empty_timeout)
+    return 1 if metrics.failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())